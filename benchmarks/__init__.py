@@ -0,0 +1,6 @@
+"""
+Benchmarks for the movie web app.
+
+Run a benchmark as a module from the repository root, e.g.
+`python -m benchmarks.sqlite_concurrency`.
+"""
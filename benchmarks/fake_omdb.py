@@ -0,0 +1,134 @@
+"""
+Offline stand-in for the OMDB client.
+
+Every title, year or IMDb ID maps to the same generated movie on every run,
+so benchmarks are deterministic and never touch the network. Titles starting
+with "missing" are not found, like unknown titles on OMDB.
+
+The details of a movie are generated from its IMDb ID, and IDs handed out for
+titles are remembered, so a later lookup by that ID (e.g. a refresh) returns
+the same movie with its title and year.
+"""
+
+import hashlib
+import random
+import threading
+import time
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Comedy", "Crime", "Drama",
+    "Fantasy", "Horror", "Mystery", "Romance", "Sci-Fi", "Thriller",
+]
+FIRST_NAMES = [
+    "Ada", "Ben", "Cleo", "Dev", "Eli", "Fay", "Gus", "Hana", "Ivo", "Jun",
+    "Kai", "Lena", "Milo", "Nia", "Omar", "Pia", "Quin", "Rosa", "Sam", "Tess",
+]
+LAST_NAMES = [
+    "Abbott", "Berg", "Costa", "Dunn", "Ellis", "Frost", "Grant", "Hale",
+    "Ito", "Jones", "Khan", "Lund", "Moss", "Novak", "Ortiz", "Park",
+]
+
+NOT_FOUND = {"Response": "False", "Error": "Movie not found!"}
+
+# title and year of the IDs generated for title lookups
+_titles: dict[str, tuple[str, int | None]] = {}
+_titles_lock = threading.Lock()
+
+
+def random_name(rng: random.Random) -> str:
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def make_movie(
+    rng: random.Random, imdb_id: str, title: str, year: int
+) -> dict:
+    """
+    Generate an OMDB movie response.
+
+    :param rng: The random generator which decides the details.
+    :param imdb_id: The IMDb ID of the movie.
+    :param title: The movie title.
+    :param year: The release year.
+    :return: A response like the ones of the OMDB API.
+    """
+    return {
+        "Response": "True",
+        "Title": title,
+        "Year": str(year),
+        "Genre": ", ".join(rng.sample(GENRES, rng.randint(1, 3))),
+        "imdbID": imdb_id,
+        "Actors": ", ".join(random_name(rng) for _ in range(3)),
+        "Director": random_name(rng),
+        "Writer": ", ".join(random_name(rng) for _ in range(2)),
+        "Plot": " ".join(rng.choice(LAST_NAMES).lower() for _ in range(30)),
+        "Poster": (
+            f"https://m.media-amazon.com/images/M/{imdb_id}._V1_SX300.jpg"
+        ),
+        "imdbRating": f"{rng.uniform(1, 10):.1f}",
+    }
+
+
+def lookup(
+    title: str | None = None,
+    year: str | int | None = None,
+    imdb_id: str | None = None,
+) -> dict:
+    """
+    Answer an OMDB lookup by title and year or by IMDb ID.
+
+    :return: The generated movie, or a "not found" response.
+    """
+    if imdb_id:
+        with _titles_lock:
+            title, year = _titles.get(imdb_id, (None, None))
+    elif title and not title.lower().startswith("missing"):
+        key = f"{title.strip().lower()}|{year or ''}"
+        digest = hashlib.sha256(key.encode()).digest()
+        imdb_id = f"tt{int.from_bytes(digest[:4], 'big') % 10**8:08d}"
+        year = int(year) if year else None
+        with _titles_lock:
+            _titles[imdb_id] = (title, year)
+    else:
+        return dict(NOT_FOUND)
+
+    # both lookups of a movie use the same generator
+    rng = random.Random(hashlib.sha256(imdb_id.encode()).digest())
+    generated_year = rng.randint(1950, 2024)
+    return make_movie(
+        rng,
+        imdb_id,
+        title or f"Movie {imdb_id}",
+        year or generated_year,
+    )
+
+
+class FakeOmdbClient:
+    """
+    Drop-in replacement for `omdb_api.OmdbClient`.
+    """
+
+    def __init__(self, latency: float = 0) -> None:
+        """
+        :param latency: Seconds every lookup sleeps, to simulate the network.
+        """
+        self.latency = latency
+        self.calls = 0
+
+    def get_movie(
+        self,
+        title: str | None = None,
+        year: str | None = None,
+        imdb_id: str | None = None,
+        **kwargs,
+    ) -> dict:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return lookup(title, year, imdb_id)
+
+    def is_known_missing(self, *args, **kwargs) -> bool:
+        # nothing is cached
+        return False
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,345 @@
+"""
+Load test of the app's main pages on a synthetic database.
+
+The app runs on a temporary database seeded by `benchmarks.seed_data`, with
+`benchmarks.fake_omdb` instead of OMDB and a fake poster download, so the
+benchmark runs offline. Every scenario sends `--requests` requests from
+`--concurrency` threads, each logged in as a different user, and reports
+latency percentiles and throughput:
+
+- index: the first library page
+- movie_details: a random movie page
+- create: adds a new movie by title, which asks the fake OMDB
+- create_missing: adds a few titles OMDB does not know, over and over
+- add_review: reviews a random movie
+- login: logs in with a fresh session
+
+Requests go through the Flask test client, or with `--server` over HTTP to a
+local threaded WSGI server. With `--omdb-server` the app's real OMDB client
+talks to `benchmarks.omdb_server`, so its retries, rate limit and breaker are
+measured as well.
+
+Usage:
+    python -m benchmarks.load --users 100 --movies 5000 --reviews 20000
+    python -m benchmarks.load --server --concurrency 8 --json load.json
+    python -m benchmarks.load --omdb-server --omdb-error-rate 0.1
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from typing import Callable
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks import fake_omdb, omdb_server, seed_data
+from movie_web import create_app
+
+SCENARIOS = (
+    "index",
+    "movie_details",
+    "create",
+    "create_missing",
+    "add_review",
+    "login",
+)
+# distinct titles of the create_missing scenario
+MISSING_TITLES = 5
+
+
+class AppClient:
+    """
+    One browser session against the app, through the Flask test client or
+    over HTTP.
+    """
+
+    def __init__(self, app, base_url: str | None = None) -> None:
+        """
+        :param app: The Flask application object.
+        :param base_url: URL of a running server, None for the test client.
+        """
+        self.base_url = base_url
+        if base_url is None:
+            self._client = app.test_client()
+        else:
+            self._session = requests.Session()
+
+    def request(self, method: str, path: str, data: dict | None = None) -> int:
+        """
+        Send a request without following redirects.
+
+        :return: The status code of the response.
+        """
+        if self.base_url is None:
+            response = self._client.open(path, method=method, data=data)
+            response.close()
+            return response.status_code
+        response = self._session.request(
+            method, self.base_url + path, data=data, allow_redirects=False
+        )
+        return response.status_code
+
+    def login(self, user_id: int) -> int:
+        return self.request(
+            "POST",
+            "/auth/login",
+            {
+                "username": seed_data.user_name(user_id),
+                "password": seed_data.PASSWORD,
+            },
+        )
+
+
+def make_request(
+    scenario: str, options: argparse.Namespace, counter: itertools.count
+) -> Callable[[AppClient, random.Random], int]:
+    """
+    :param scenario: One of `SCENARIOS`.
+    :param options: The command line options.
+    :param counter: Shared counter for unique titles.
+    :return: A function sending one request of the scenario.
+    """
+    if scenario == "index":
+        return lambda client, rng: client.request("GET", "/")
+    if scenario == "movie_details":
+        return lambda client, rng: client.request(
+            "GET", f"/movie/{rng.randint(1, options.movies)}"
+        )
+    if scenario == "create":
+        return lambda client, rng: client.request(
+            "POST",
+            "/create",
+            {"title": f"Load test {next(counter)}", "year": "", "imdb_id": ""},
+        )
+    if scenario == "create_missing":
+        return lambda client, rng: client.request(
+            "POST",
+            "/create",
+            {
+                "title": f"Missing {rng.randrange(MISSING_TITLES)}",
+                "year": "",
+                "imdb_id": "",
+            },
+        )
+    if scenario == "add_review":
+        return lambda client, rng: client.request(
+            "POST",
+            f"/movie/{rng.randint(1, options.movies)}/review",
+            {"text": "Load test review", "rating": rng.randint(0, 10) / 2},
+        )
+    if scenario == "login":
+        return lambda client, rng: client.login(
+            rng.randint(1, options.users)
+        )
+    raise ValueError(f"Unknown scenario {scenario}")
+
+
+def run_scenario(
+    scenario: str, app, base_url: str | None, options: argparse.Namespace
+) -> dict:
+    send = make_request(scenario, options, itertools.count())
+    per_thread = max(1, options.requests // options.concurrency)
+
+    clients = []
+    for n in range(options.concurrency):
+        client = AppClient(app, base_url)
+        if scenario != "login":
+            client.login(n % options.users + 1)
+        clients.append(client)
+
+    latencies: list[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(n: int, client: AppClient) -> None:
+        nonlocal errors
+        rng = random.Random(f"{options.seed}-{scenario}-{n}")
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            try:
+                failed = send(client, rng) >= 400
+            except requests.RequestException:
+                failed = True
+            latency = time.perf_counter() - started
+            with lock:
+                latencies.append(latency)
+                errors += failed
+
+    threads = [
+        threading.Thread(target=worker, args=(n, client))
+        for n, client in enumerate(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": scenario,
+        **summarize(latencies, elapsed),
+        "errors": errors,
+    }
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    """
+    :param latencies: Request latencies in seconds.
+    :param elapsed: Wall time of all requests in seconds.
+    :return: Count, throughput and latency percentiles in milliseconds.
+    """
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0.0
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies or [0]) * 1000, 2),
+        "p50_ms": round(p50 * 1000, 2),
+        "p95_ms": round(p95 * 1000, 2),
+        "p99_ms": round(p99 * 1000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    parser.add_argument("--library-size", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS
+    )
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        help="Send requests over HTTP to a local WSGI server.",
+    )
+    parser.add_argument(
+        "--omdb-server",
+        action="store_true",
+        help="Use the OMDB client with a local fake OMDB server.",
+    )
+    parser.add_argument(
+        "--omdb-latency",
+        type=float,
+        default=0,
+        help="Seconds every fake OMDB lookup takes.",
+    )
+    parser.add_argument(
+        "--omdb-error-rate",
+        type=float,
+        default=0,
+        help="Share of 503 answers of the fake OMDB server.",
+    )
+    parser.add_argument(
+        "--omdb-rate-limit",
+        type=float,
+        default=5,
+        help="OMDB requests per second allowed by the OMDB client.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the results to this file.")
+    options = parser.parse_args()
+
+    omdb = None
+    if options.omdb_server:
+        omdb = omdb_server.start_server(
+            omdb_server.FakeOmdb(
+                latency=options.omdb_latency,
+                error_rate=options.omdb_error_rate,
+                seed=options.seed,
+            )
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = {
+            "SECRET_KEY": "benchmark",
+            "DATABASE_PATH": os.path.join(directory, "movie_web.sqlite"),
+            "POSTER_DIR": os.path.join(directory, "posters"),
+            "POSTER_FETCHER": lambda url: b"poster",
+            "OMDB_RATE_LIMIT": options.omdb_rate_limit,
+            # every run starts cold, with an in-memory response cache only
+            "OMDB_CACHE_PATH": None,
+        }
+        if omdb is not None:
+            host, port = omdb.server_address[:2]
+            config["OMDB_BASE_URL"] = f"http://{host}:{port}/"
+            config["OMDB_API_KEY"] = "benchmark"
+        app = create_app(config)
+
+        if omdb is None:
+            app.extensions["omdb_client"] = fake_omdb.FakeOmdbClient(
+                options.omdb_latency
+            )
+        with app.app_context():
+            seed_data.seed_database(
+                options.users,
+                options.movies,
+                options.reviews,
+                library_size=options.library_size,
+                seed=options.seed,
+            )
+
+        server = None
+        base_url = None
+        if options.server:
+            # keep the access log out of the results
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.port}"
+
+        try:
+            results = [
+                run_scenario(scenario, app, base_url, options)
+                for scenario in options.scenarios
+            ]
+        finally:
+            for running in (server, omdb):
+                if running is not None:
+                    running.shutdown()
+                    running.server_close()
+
+    print(
+        f"{'scenario':<15}{'requests':>9}{'req/s':>9}{'p50 ms':>9}"
+        f"{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+    )
+    for result in results:
+        print(
+            f"{result['scenario']:<15}{result['requests']:>9}"
+            f"{result['requests_per_second']:>9}{result['p50_ms']:>9}"
+            f"{result['p95_ms']:>9}{result['p99_ms']:>9}{result['errors']:>8}"
+        )
+
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "options": {
+                        key: value
+                        for key, value in vars(options).items()
+                        if key != "json"
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
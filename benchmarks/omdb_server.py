@@ -0,0 +1,272 @@
+"""
+Local stand-in for the OMDB API.
+
+Answers `t` (with `y`), `i` and `s` (with `page`) queries like
+www.omdbapi.com, with movies generated by `benchmarks.fake_omdb`. Latency and
+429/5xx error rates can be injected from a seeded random generator, so runs
+are reproducible. Responses recorded from the real API (`--record`) are
+replayed before anything is generated (`--fixtures`).
+
+Point the app at it with `FLASK_OMDB_BASE_URL`, any API key is accepted.
+
+Usage:
+    python -m benchmarks.omdb_server --port 8001 --latency 0.2 --error-rate 0.05
+    FLASK_OMDB_BASE_URL=http://127.0.0.1:8001/ FLASK_OMDB_API_KEY=fake \
+        flask --app movie_web run
+
+    # record real responses, then replay them offline
+    python -m benchmarks.omdb_server --record fixtures.json --apikey KEY
+    python -m benchmarks.omdb_server --fixtures fixtures.json
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+from benchmarks import fake_omdb
+from movie_web.omdb_api import OMDB_URL
+from movie_web.omdb_cache import OmdbCache
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_RESULTS = 35
+
+
+class FakeOmdb:
+    """
+    Answers OMDB queries from fixtures, a recording upstream or
+    `fake_omdb`, with injected latency and errors.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        rate_limit_rate: float = 0,
+        fixtures: dict[str, dict] | None = None,
+        record_to: str | None = None,
+        upstream_url: str = OMDB_URL,
+        apikey: str | None = None,
+        seed: int = 0,
+    ) -> None:
+        """
+        :param latency: Seconds every response is delayed.
+        :param jitter: Up to this many seconds are added to the latency.
+        :param error_rate: Share of requests answered with 503.
+        :param rate_limit_rate: Share of requests answered with 429.
+        :param fixtures: Recorded responses by `OmdbCache.make_key` key.
+        :param record_to: Forward unknown queries to `upstream_url` and save
+            the responses with the fixtures to this file.
+        :param upstream_url: The OMDB endpoint used for recording.
+        :param apikey: API key for the upstream, the one of the request is
+            used otherwise.
+        :param seed: Seed of the random generator deciding errors and jitter.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.fixtures = fixtures or {}
+        self.record_to = record_to
+        self.upstream_url = upstream_url
+        self.apikey = apikey
+        self.requests = 0
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def handle(self, params: dict[str, str]) -> tuple[int, dict]:
+        """
+        :param params: The query parameters of the request.
+        :return: The status code and the JSON body of the response.
+        """
+        with self._lock:
+            self.requests += 1
+            roll = self._rng.random()
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+
+        if delay:
+            time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            return 429, {"Response": "False", "Error": "Request limit reached!"}
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503, {"Response": "False", "Error": "Service unavailable."}
+
+        key = OmdbCache.make_key(params)
+        if key in self.fixtures:
+            return 200, self.fixtures[key]
+        if self.record_to:
+            return 200, self.record(key, params)
+        return 200, answer(params)
+
+    def record(self, key: str, params: dict[str, str]) -> dict:
+        if self.apikey:
+            params = {**params, "apikey": self.apikey}
+        response = requests.get(self.upstream_url, params=params, timeout=10)
+        response.raise_for_status()
+        body = response.json()
+
+        with self._lock:
+            self.fixtures[key] = body
+            save_fixtures(self.record_to, self.fixtures)
+        return body
+
+
+def answer(params: dict[str, str]) -> dict:
+    """
+    Generate the response of an OMDB query.
+
+    :param params: The query parameters of the request.
+    :return: A response like the ones of the OMDB API.
+    """
+    if params.get("i"):
+        return fake_omdb.lookup(imdb_id=params["i"])
+    if params.get("t"):
+        return fake_omdb.lookup(params["t"], params.get("y"))
+    if params.get("s"):
+        return search(params["s"], params.get("y"), params.get("page"))
+    return {"Response": "False", "Error": "Incorrect IMDb ID."}
+
+
+def search(query: str, year: str | None, page: str | None) -> dict:
+    """
+    Generate a page of search results. The results are the movies of the
+    titles "<query> 1", "<query> 2", ..., so looking them up by title returns
+    the same movies.
+
+    :return: A search response like the ones of the OMDB API.
+    """
+    page_number = int(page) if page and page.isdigit() else 1
+    first = (page_number - 1) * SEARCH_PAGE_SIZE + 1
+    last = min(first + SEARCH_PAGE_SIZE, SEARCH_RESULTS + 1)
+    if query.lower().startswith("missing") or first > SEARCH_RESULTS:
+        return dict(fake_omdb.NOT_FOUND)
+
+    results = []
+    for n in range(first, last):
+        movie = fake_omdb.lookup(f"{query} {n}", year)
+        results.append({
+            "Title": movie["Title"],
+            "Year": movie["Year"],
+            "imdbID": movie["imdbID"],
+            "Type": "movie",
+            "Poster": movie["Poster"],
+        })
+    return {
+        "Search": results,
+        "totalResults": str(SEARCH_RESULTS),
+        "Response": "True",
+    }
+
+
+def load_fixtures(path: str | None) -> dict[str, dict]:
+    if not path:
+        return {}
+    try:
+        with open(path, encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_fixtures(path: str, fixtures: dict[str, dict]) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(fixtures, file, indent=2, sort_keys=True)
+
+
+def make_handler(omdb: FakeOmdb) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            params = dict(parse_qsl(urlsplit(self.path).query))
+            try:
+                status, body = omdb.handle(params)
+            except requests.RequestException as e:
+                status = HTTPStatus.BAD_GATEWAY
+                body = {"Response": "False", "Error": str(e)}
+
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    return Handler
+
+
+def start_server(
+    omdb: FakeOmdb, host: str = "127.0.0.1", port: int = 0
+) -> ThreadingHTTPServer:
+    """
+    Serve `omdb` from a background thread.
+
+    :param omdb: The fake OMDB answering the requests.
+    :param host: The address to listen on.
+    :param port: The port, 0 picks a free one.
+    :return: The running server, stop it with `shutdown()`.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(omdb))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="Share of 503 answers."
+    )
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0, help="Share of 429 answers."
+    )
+    parser.add_argument("--fixtures", help="Replay responses from this file.")
+    parser.add_argument(
+        "--record",
+        help="Forward unknown queries to OMDB and save them to this file.",
+    )
+    parser.add_argument("--upstream", default=OMDB_URL)
+    parser.add_argument("--apikey", help="API key used for recording.")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    omdb = FakeOmdb(
+        latency=options.latency,
+        jitter=options.jitter,
+        error_rate=options.error_rate,
+        rate_limit_rate=options.rate_limit_rate,
+        fixtures=load_fixtures(options.fixtures or options.record),
+        record_to=options.record,
+        upstream_url=options.upstream,
+        apikey=options.apikey,
+        seed=options.seed,
+    )
+    server = ThreadingHTTPServer(
+        (options.host, options.port), make_handler(omdb)
+    )
+    print(f"Fake OMDB on http://{options.host}:{server.server_port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
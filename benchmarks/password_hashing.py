@@ -0,0 +1,102 @@
+"""
+Login throughput of one app worker with and without the hashing process pool.
+
+Login threads verify a password in a loop, like concurrent login requests in
+one threaded worker. At the same time a single thread serves cheap "page"
+requests, which only need the GIL. The benchmark reports logins per second
+and how many page requests the worker still served, once with hashing on the
+request threads and once through `movie_web.passwords.PasswordHasher`.
+
+Usage:
+    python -m benchmarks.password_hashing --threads 8 --duration 5
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from movie_web.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def page_request() -> None:
+    # pure Python work, stands in for routing and template rendering
+    sum(i * i for i in range(2000))
+
+
+def run_mode(name: str, workers: int, options: argparse.Namespace) -> dict:
+    hasher = PasswordHasher(
+        method=options.method,
+        workers=workers,
+        max_pending=options.threads,
+    )
+    password_hash = generate_password_hash("benchmark", options.method)
+    hasher.verify(password_hash, "benchmark")  # start the pool
+
+    deadline = time.perf_counter() + options.duration
+    counts = {"logins": 0, "busy": 0, "pages": 0}
+    lock = threading.Lock()
+
+    def login_loop() -> None:
+        while time.perf_counter() < deadline:
+            try:
+                hasher.verify(password_hash, "benchmark")
+                key = "logins"
+            except PasswordHasherBusy:
+                key = "busy"
+            with lock:
+                counts[key] += 1
+
+    def page_loop() -> None:
+        while time.perf_counter() < deadline:
+            page_request()
+            counts["pages"] += 1
+
+    threads = [threading.Thread(target=login_loop) for _ in range(options.threads)]
+    threads.append(threading.Thread(target=page_loop))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    hasher.close()
+
+    return {
+        "mode": name,
+        "workers": workers,
+        "logins_per_second": round(counts["logins"] / options.duration, 1),
+        "pages_per_second": round(counts["pages"] / options.duration, 1),
+        "busy": counts["busy"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--method", default="scrypt")
+    parser.add_argument("--json", help="Write the results to this file.")
+    options = parser.parse_args()
+
+    results = [
+        run_mode("inline", 0, options),
+        run_mode("pool", options.workers, options),
+    ]
+
+    print(f"{'mode':<8}{'workers':>8}{'logins/s':>12}{'pages/s':>12}{'busy':>8}")
+    for result in results:
+        print(
+            f"{result['mode']:<8}{result['workers']:>8}"
+            f"{result['logins_per_second']:>12}"
+            f"{result['pages_per_second']:>12}{result['busy']:>8}"
+        )
+
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+Deterministic synthetic data for benchmarks.
+
+Seeds users, movies, libraries and reviews directly through `db_models`, so
+large databases are created in seconds. The same arguments always produce
+the same database. Movies are generated like `fake_omdb` answers them, so
+benchmarks which add movies see consistent data.
+
+Usage:
+    with app.app_context():
+        seed_database(users=100, movies=5000, reviews=20000)
+
+    python -m benchmarks.seed_data --users 100 --movies 5000 --reviews 20000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from sqlalchemy import insert, select
+
+import movie_web.db_manager as db_manager
+from benchmarks import fake_omdb
+from movie_web import create_app
+from movie_web.db_models import Movie, Review, User, UserMovie, db
+from movie_web.passwords import get_hasher
+
+PASSWORD = "benchmark"
+BATCH_SIZE = 1000
+
+
+def user_name(user_id: int) -> str:
+    return f"user{user_id}"
+
+
+def imdb_id(movie_id: int) -> str:
+    return f"tt{movie_id:08d}"
+
+
+def seed_database(
+    users: int,
+    movies: int,
+    reviews: int,
+    library_size: int = 50,
+    seed: int = 0,
+) -> dict[str, int]:
+    """
+    Insert synthetic users, movies, libraries and reviews into the database
+    of the current app, which should be empty.
+
+    Every user has the password `PASSWORD`.
+
+    :param users: Number of users.
+    :param movies: Number of movies.
+    :param reviews: Number of reviews, each by a different user and movie
+        pair.
+    :param library_size: Number of movies in every user's library.
+    :param seed: Seed of the random generator.
+    :return: The number of inserted rows per table.
+    """
+    rng = random.Random(seed)
+    reviews = min(reviews, users * movies)
+    library_size = min(library_size, movies)
+
+    # one hash for everyone, with the configured method so logins do not
+    # rehash
+    password_hash = get_hasher().hash(PASSWORD)
+    insert_batches(
+        User,
+        (
+            {"id": i, "user_name": user_name(i), "password": password_hash}
+            for i in range(1, users + 1)
+        ),
+    )
+
+    def movie_rows():
+        for i in range(1, movies + 1):
+            response = fake_omdb.lookup(imdb_id=imdb_id(i))
+            movie = db_manager.serialize_omdb_movie(response)
+            yield {
+                "id": i,
+                "last_fetched": movie.last_fetched,
+                **{
+                    key: getattr(movie, key)
+                    for key in db_manager.REQUIRED_MOVIE_KEYS
+                },
+            }
+
+    insert_batches(Movie, movie_rows())
+    for start in range(0, movies, BATCH_SIZE):
+        stmt = (
+            select(Movie)
+            .where(Movie.id > start, Movie.id <= start + BATCH_SIZE)
+            .order_by(Movie.id)
+        )
+        db_manager.sync_movie_facets(db.session.execute(stmt).scalars().all())
+        db.session.expunge_all()
+
+    insert_batches(
+        UserMovie,
+        (
+            {"user_id": user_id, "movie_id": movie_id}
+            for user_id in range(1, users + 1)
+            for movie_id in sorted(
+                rng.sample(range(1, movies + 1), library_size)
+            )
+        ),
+    )
+
+    # distinct (user, movie) pairs, encoded as one number each
+    pairs = rng.sample(range(users * movies), reviews)
+    insert_batches(
+        Review,
+        (
+            {
+                "user_id": pair // movies + 1,
+                "movie_id": pair % movies + 1,
+                "text": f"Synthetic review {n}",
+                "rating": rng.randint(0, 10) / 2,
+            }
+            for n, pair in enumerate(pairs)
+        ),
+    )
+
+    db.session.commit()
+    return {
+        "users": users,
+        "movies": movies,
+        "user_movies": users * library_size,
+        "reviews": reviews,
+    }
+
+
+def insert_batches(model, rows) -> None:
+    """
+    Insert rows with executemany in batches of `BATCH_SIZE`.
+
+    :param model: The model class.
+    :param rows: An iterable of column dictionaries.
+    """
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(model), batch)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("database", help="Path of the new SQLite database.")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--reviews", type=int, default=20000)
+    parser.add_argument("--library-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    if os.path.exists(options.database):
+        parser.error(f"{options.database} already exists")
+
+    app = create_app({"DATABASE_PATH": os.path.abspath(options.database)})
+    started = time.perf_counter()
+    with app.app_context():
+        counts = seed_database(
+            options.users,
+            options.movies,
+            options.reviews,
+            library_size=options.library_size,
+            seed=options.seed,
+        )
+    elapsed = time.perf_counter() - started
+    print(", ".join(f"{count} {table}" for table, count in counts.items()))
+    print(f"seeded in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
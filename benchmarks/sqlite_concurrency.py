@@ -0,0 +1,207 @@
+"""
+Read/write throughput of the SQLite database under concurrent clients.
+
+Every client is a separate process with its own engine, like a gunicorn
+worker. Clients run a mix of the app's hottest reads (movie page, library
+page) and writes (review upserts) for a fixed time. The benchmark runs once
+with SQLite's default settings and once with the app's engine profile from
+`movie_web.db_engine`.
+
+Usage:
+    python -m benchmarks.sqlite_concurrency --clients 8 --duration 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, create_engine, insert, select, text
+from sqlalchemy.exc import OperationalError
+
+from movie_web.db_engine import DEFAULT_PRAGMAS, register_pragmas
+from movie_web.db_models import Movie, Review, User, UserMovie, db
+
+PROFILES = {
+    "default": {},
+    "app": DEFAULT_PRAGMAS,
+}
+
+MOVIE_PAGE = (
+    select(Movie, Review)
+    .outerjoin(Review, Review.movie_id == Movie.id)
+    .where(Movie.id == bindparam("movie_id"))
+)
+LIBRARY_PAGE = (
+    select(Movie.id, Movie.title, Movie.year, Movie.poster_link)
+    .join(UserMovie, UserMovie.movie_id == Movie.id)
+    .where(UserMovie.user_id == bindparam("user_id"))
+    .order_by(UserMovie.movie_id)
+    .limit(24)
+)
+UPSERT_REVIEW = text(
+    "INSERT INTO review (user_id, movie_id, text, rating, created) "
+    "VALUES (:user_id, :movie_id, :text, :rating, :created) "
+    "ON CONFLICT (user_id, movie_id) DO UPDATE SET "
+    "text = excluded.text, rating = excluded.rating, updated = excluded.created"
+)
+
+
+def make_engine(path: str, pragmas: dict):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 5})
+    register_pragmas(engine, pragmas)
+    return engine
+
+
+def seed(path: str, users: int, movies: int) -> None:
+    """
+    Create the schema and seed users, movies and libraries.
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(
+            insert(User),
+            [
+                {"id": i, "user_name": f"user{i}", "password": "x"}
+                for i in range(1, users + 1)
+            ],
+        )
+        connection.execute(
+            insert(Movie),
+            [
+                {
+                    "id": i,
+                    "title": f"Movie {i}",
+                    "year": 1950 + i % 70,
+                    "genre": "Drama",
+                    "imdb_id": f"tt{i:07d}",
+                    "stars": "A, B, C",
+                    "director": "D",
+                    "writer": "W",
+                    "plot": "plot " * 50,
+                    "poster_link": f"https://example.com/{i}.jpg",
+                    "imdb_rating": 7.0,
+                }
+                for i in range(1, movies + 1)
+            ],
+        )
+        rng = random.Random(0)
+        connection.execute(
+            insert(UserMovie),
+            [
+                {"user_id": user_id, "movie_id": movie_id}
+                for user_id in range(1, users + 1)
+                for movie_id in rng.sample(range(1, movies + 1), 50)
+            ],
+        )
+    engine.dispose()
+
+
+def run_client(args) -> dict:
+    """
+    Run reads and writes until the deadline. Runs in a client process.
+    """
+    path, pragmas, deadline, write_ratio, users, movies, seed_value = args
+    rng = random.Random(seed_value)
+    engine = make_engine(path, pragmas)
+    reads = writes = errors = 0
+
+    while time.time() < deadline:
+        try:
+            if rng.random() < write_ratio:
+                with engine.begin() as connection:
+                    connection.execute(
+                        UPSERT_REVIEW,
+                        {
+                            "user_id": rng.randint(1, users),
+                            "movie_id": rng.randint(1, movies),
+                            "text": "benchmark review",
+                            "rating": rng.randint(0, 5),
+                            "created": datetime.now(timezone.utc),
+                        },
+                    )
+                writes += 1
+            else:
+                with engine.connect() as connection:
+                    if rng.random() < 0.5:
+                        connection.execute(
+                            MOVIE_PAGE, {"movie_id": rng.randint(1, movies)}
+                        ).all()
+                    else:
+                        connection.execute(
+                            LIBRARY_PAGE, {"user_id": rng.randint(1, users)}
+                        ).all()
+                reads += 1
+        except OperationalError:
+            # "database is locked" after the busy timeout
+            errors += 1
+
+    engine.dispose()
+    return {"reads": reads, "writes": writes, "errors": errors}
+
+
+def run_profile(name: str, options: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.sqlite")
+        seed(path, options.users, options.movies)
+
+        deadline = time.time() + options.duration
+        client_args = [
+            (
+                path,
+                PROFILES[name],
+                deadline,
+                options.write_ratio,
+                options.users,
+                options.movies,
+                client,
+            )
+            for client in range(options.clients)
+        ]
+        with multiprocessing.Pool(options.clients) as pool:
+            results = pool.map(run_client, client_args)
+
+    totals = {
+        key: sum(result[key] for result in results)
+        for key in ("reads", "writes", "errors")
+    }
+    return {
+        "profile": name,
+        "clients": options.clients,
+        "reads_per_second": round(totals["reads"] / options.duration, 1),
+        "writes_per_second": round(totals["writes"] / options.duration, 1),
+        "errors": totals["errors"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--json", help="Write the results to this file.")
+    options = parser.parse_args()
+
+    results = [run_profile(name, options) for name in PROFILES]
+
+    print(f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'errors':>10}")
+    for result in results:
+        print(
+            f"{result['profile']:<10}{result['reads_per_second']:>12}"
+            f"{result['writes_per_second']:>12}{result['errors']:>10}"
+        )
+
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
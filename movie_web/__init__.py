@@ -3,7 +3,26 @@ import os
 from dotenv import load_dotenv
 from flask import Flask
 
-from . import auth, blog, db_models, error
+from . import (
+    api,
+    auth,
+    blog,
+    cli,
+    db_engine,
+    db_models,
+    db_schema,
+    error,
+    identity_cache,
+    metrics,
+    movie_jobs,
+    omdb_api,
+    page_cache,
+    passwords,
+    posters,
+    query_budget,
+    query_log,
+    refresher,
+)
 
 ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
 DB_FOLDER = "./data"
@@ -20,19 +39,82 @@ def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_mapping(
         SECRET_KEY=flask_secret_key,
-        SQLALCHEMY_DATABASE_URI=f"sqlite:///{DB_PATH}",
+        DATABASE_PATH=DB_PATH,
+        SQLALCHEMY_ENGINE_OPTIONS=dict(db_engine.DEFAULT_ENGINE_OPTIONS),
+        SQLITE_PRAGMAS=dict(db_engine.DEFAULT_PRAGMAS),
+        OMDB_API_KEY=omdb_api.API_KEY,
+        OMDB_BASE_URL=omdb_api.OMDB_URL,
+        OMDB_TIMEOUT=5,
+        OMDB_RETRIES=2,
+        OMDB_POOL_SIZE=10,
+        OMDB_RATE_LIMIT=5,
+        OMDB_BURST=10,
+        OMDB_FAILURE_THRESHOLD=5,
+        OMDB_RESET_TIMEOUT=30,
+        OMDB_CACHE_PATH=omdb_api.CACHE_PATH,
+        OMDB_CACHE_TTL=omdb_api.CACHE_TTL,
+        OMDB_CACHE_SIZE=omdb_api.CACHE_SIZE,
+        OMDB_NEGATIVE_CACHE_TTL=omdb_api.NEGATIVE_CACHE_TTL,
+        MOVIE_REFRESH_INTERVAL=0,
+        MOVIE_REFRESH_MAX_AGE=7 * 24 * 60 * 60,
+        MOVIE_REFRESH_BATCH_SIZE=50,
+        LIBRARY_PAGE_SIZE=24,
+        SEARCH_PAGE_SIZE=24,
+        MOVIE_JOB_WORKERS=2,
+        PAGE_CACHE_SIZE=1024,
+        POSTER_DIR=posters.DEFAULT_POSTER_DIR,
+        POSTER_FETCHER=None,
+        POSTER_WORKERS=2,
+        POSTER_HOSTS=posters.DEFAULT_POSTER_HOSTS,
+        PASSWORD_HASH_METHOD="scrypt",
+        PASSWORD_HASH_WORKERS=2,
+        PASSWORD_HASH_MAX_PENDING=16,
+        USER_CACHE_TTL=60,
+        USER_CACHE_SIZE=1024,
+        METRICS_BLUEPRINTS=("blog", "auth", "api"),
+        METRICS_TOKEN=None,
+        METRICS_ALLOW_LOCAL=False,
+        QUERY_BUDGET_ENFORCE=False,
+        QUERY_LOG_ENABLED=False,
+        SLOW_QUERY_THRESHOLD=0.1,
+        N_PLUS_ONE_THRESHOLD=5,
     )
+    # e.g. FLASK_OMDB_RATE_LIMIT=2 overrides OMDB_RATE_LIMIT
+    app.config.from_prefixed_env()
+
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+
+    # e.g. FLASK_DATABASE_PATH=/var/lib/movie_web/movie_web.sqlite
+    if "SQLALCHEMY_DATABASE_URI" not in app.config:
+        db_path = app.config["DATABASE_PATH"]
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
 
     db_models.db.init_app(app)
+    db_engine.init_app(app)
+    omdb_api.init_app(app)
+    query_budget.init_app(app)
+    metrics.init_app(app)
+    query_log.init_app(app)
+    page_cache.init_app(app)
+    posters.init_app(app)
+    passwords.init_app(app)
+    identity_cache.init_app(app)
 
     with app.app_context():
         db_models.db.create_all()
+        db_schema.upgrade_schema()
 
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    app.register_blueprint(api.bp)
     app.add_url_rule("/", endpoint="index")
 
     error.register_error_handlers(app)
+    cli.register_commands(app)
+    refresher.init_app(app)
+    movie_jobs.init_app(app)
 
     # # run only once for dummy data population
     # with app.app_context():
@@ -0,0 +1,379 @@
+"""
+Versioned JSON API of the library, movies and reviews.
+
+All endpoints live under `/api/v1` and use the session of the logged-in
+user. Lists are paginated with the cursor of the previous page (`after`) and
+return the cursor of the next page as `next`, which is null on the last page.
+The `fields` parameter selects the returned fields, e.g.
+`?fields=title,year`, and only those columns are queried. Responses carry
+weak ETags for conditional requests and are gzip compressed for clients
+which accept it. Errors are JSON objects with `error` and `message`.
+
+Batch endpoints add or remove many movies of the library and import or
+delete many reviews with one set-based statement and a single commit.
+
+Usage:
+    GET /api/v1/library?genre=Drama&fields=title,year&after=42
+    GET /api/v1/movies/7?fields=title,plot,avg_rating
+    GET /api/v1/movies/7/reviews?limit=50
+    POST /api/v1/library/movies {"movie_ids": [7, 8, 9]}
+    GET /api/v1/jobs/3
+"""
+
+import gzip
+import hashlib
+import json
+
+from flask import Blueprint, Response, abort, current_app, g, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import HTTP_STATUS_CODES
+
+import movie_web.db_manager as db_manager
+from movie_web import metrics
+from movie_web.auth import login_required
+from movie_web.db_models import Movie, Review, User
+from movie_web.error import ERROR_MESSAGES
+from movie_web.page_cache import make_etag
+from movie_web.query_budget import query_budget
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+MOVIE_FIELDS = {
+    "id": Movie.id,
+    "title": Movie.title,
+    "year": Movie.year,
+    "genre": Movie.genre,
+    "imdb_id": Movie.imdb_id,
+    "stars": Movie.stars,
+    "director": Movie.director,
+    "writer": Movie.writer,
+    "plot": Movie.plot,
+    "poster_link": Movie.poster_link,
+    "imdb_rating": Movie.imdb_rating,
+    "review_count": Movie.review_count,
+    "avg_rating": Movie.avg_rating,
+}
+REVIEW_FIELDS = {
+    "id": Review.id,
+    "user_id": Review.user_id,
+    "user_name": User.user_name,
+    "rating": Review.rating,
+    "text": Review.text,
+    "created": Review.created,
+    "updated": Review.updated,
+}
+LIBRARY_DEFAULT_FIELDS = ("id", "title", "year", "poster_link")
+
+MAX_PAGE_SIZE = 100
+MAX_BATCH_SIZE = 500
+# smaller bodies are not worth the compression time
+GZIP_MIN_SIZE = 500
+
+
+def json_error(e: Exception) -> Response:
+    """
+    Answer errors of the API views with JSON instead of an error page.
+
+    :param e: The exception, an HTTP exception or any other error.
+    :return: The JSON error response.
+    """
+    code = getattr(e, "code", None) or 500
+    metrics.ERRORS.inc(code=str(code))
+    if isinstance(e, HTTPException):
+        message = e.description
+    else:
+        message = ERROR_MESSAGES.get(code, ERROR_MESSAGES["default"])
+    body = {"error": HTTP_STATUS_CODES.get(code, "Error"), "message": message}
+    return make_json_response(encode(body), status=code)
+
+
+# the app's error pages are registered per status code, which takes
+# precedence over handlers for exception classes
+for code in ERROR_MESSAGES:
+    if isinstance(code, int):
+        bp.register_error_handler(code, json_error)
+bp.register_error_handler(Exception, json_error)
+
+
+@bp.route("/library")
+@query_budget(2)
+@login_required
+def library() -> Response:
+    """
+    One page of the user's library, filtered like the index page with
+    `genre`, or `person` and `role`.
+
+    :return: The movies and the cursor of the next page.
+    """
+    columns = select_fields(MOVIE_FIELDS, LIBRARY_DEFAULT_FIELDS)
+    movies, next_cursor = db_manager.get_user_movie_rows(
+        g.user.id,
+        columns,
+        after_id=request.args.get("after", type=int),
+        page_size=page_size(),
+        **{
+            key: request.args[key]
+            for key in ("genre", "person", "role")
+            if request.args.get(key)
+        },
+    )
+    return json_response({"movies": movies, "next": next_cursor})
+
+
+@bp.route("/movies/<int:movie_id>")
+@query_budget(3)
+@login_required
+def movie(movie_id: int) -> Response:
+    """
+    The details of a movie. Conditional requests are answered from the data
+    version of the movie, without loading it.
+
+    :param movie_id: The ID of the movie.
+    :return: The movie.
+    """
+    columns = select_fields(MOVIE_FIELDS, MOVIE_FIELDS)
+    return versioned_response(
+        movie_id, lambda: db_manager.get_movie_row(movie_id, columns)
+    )
+
+
+@bp.route("/movies/<int:movie_id>/reviews")
+@query_budget(3)
+@login_required
+def movie_reviews(movie_id: int) -> Response:
+    """
+    One page of the reviews of a movie, oldest first.
+
+    :param movie_id: The ID of the movie.
+    :return: The reviews and the cursor of the next page.
+    """
+    columns = select_fields(REVIEW_FIELDS, REVIEW_FIELDS)
+
+    def load() -> dict:
+        reviews, next_cursor = db_manager.get_movie_review_rows(
+            movie_id,
+            columns,
+            after_id=request.args.get("after", type=int),
+            page_size=page_size(),
+        )
+        return {"reviews": reviews, "next": next_cursor}
+
+    return versioned_response(movie_id, load)
+
+
+@bp.route("/library/movies", methods=("POST", "DELETE"))
+@query_budget(2)
+@login_required
+def library_movies() -> Response:
+    """
+    Add (POST) or remove (DELETE) several movies of the user's library in
+    one transaction. The body is `{"movie_ids": [1, 2, ...]}`.
+
+    :return: The number of added or removed movies.
+    """
+    movie_ids = read_ids("movie_ids")
+    if request.method == "POST":
+        added = db_manager.add_movies_to_user(g.user.id, movie_ids)
+        return json_response({"added": added})
+    removed = db_manager.remove_movies_from_user(g.user.id, movie_ids)
+    return json_response({"removed": removed})
+
+
+@bp.route("/reviews", methods=("POST",))
+@query_budget(3)
+@login_required
+def import_reviews() -> Response:
+    """
+    Add or update several reviews of the user in one transaction. The body
+    is `{"reviews": [{"movie_id": 1, "rating": 4.5, "text": "..."}, ...]}`.
+
+    :return: The IDs of the reviewed movies and of the skipped unknown ones.
+    """
+    reviews = read_list("reviews")
+    for n, review in enumerate(reviews):
+        error = check_review(review)
+        if error:
+            abort(400, f"Review {n}: {error}")
+
+    imported = db_manager.import_reviews(g.user.id, reviews)
+    skipped = {review["movie_id"] for review in reviews} - set(imported)
+    return json_response({"imported": imported, "skipped": sorted(skipped)})
+
+
+@bp.route("/reviews", methods=("DELETE",))
+@query_budget(2)
+@login_required
+def delete_reviews() -> Response:
+    """
+    Delete the reviews of the user for several movies in one transaction.
+    The body is `{"movie_ids": [1, 2, ...]}`.
+
+    :return: The number of deleted reviews.
+    """
+    movie_ids = read_ids("movie_ids")
+    deleted = db_manager.delete_user_reviews(g.user.id, movie_ids)
+    return json_response({"deleted": deleted})
+
+
+@bp.route("/jobs/<int:job_id>")
+@query_budget(2)
+@login_required
+def job_status(job_id: int) -> Response:
+    """
+    The status of a movie lookup queued by the create page: pending,
+    running, done or failed.
+
+    :param job_id: The ID of the job.
+    :return: The status, the ID of the added movie and the error message.
+    """
+    job = db_manager.get_movie_job(job_id)
+    if job is None or job.user_id != g.user.id:
+        abort(404, "Job not found.")
+    return json_response({
+        "id": job.id,
+        "status": job.status,
+        "movie_id": job.movie_id,
+        "error": job.error,
+    })
+
+
+def read_list(key: str) -> list:
+    """
+    Read a list from the JSON body of a batch request.
+
+    :param key: The key of the list in the body.
+    :return: The list, with at most `MAX_BATCH_SIZE` items.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(key), list):
+        abort(400, f'Expected a JSON object with a "{key}" list.')
+    if len(data[key]) > MAX_BATCH_SIZE:
+        abort(400, f"At most {MAX_BATCH_SIZE} items per request.")
+    return data[key]
+
+
+def read_ids(key: str) -> list[int]:
+    ids = read_list(key)
+    if not all(isinstance(value, int) for value in ids):
+        abort(400, f'"{key}" must be a list of integers.')
+    return ids
+
+
+def check_review(review) -> str | None:
+    """
+    :param review: One item of a review import.
+    :return: An error message, or None if the review is valid.
+    """
+    if not isinstance(review, dict):
+        return "expected an object"
+    if not isinstance(review.get("movie_id"), int):
+        return '"movie_id" must be an integer'
+    rating = review.get("rating")
+    if not isinstance(rating, (int, float)) or not 0 <= rating <= 5:
+        return '"rating" must be a number from 0 to 5'
+    if not isinstance(review.get("text", ""), (str, type(None))):
+        return '"text" must be a string'
+    return None
+
+
+def select_fields(available: dict, default) -> list:
+    """
+    Turn the `fields` parameter into labeled columns. The ID is always
+    selected, because it is the cursor.
+
+    :param available: Column expressions by field name.
+    :param default: Field names used without a `fields` parameter.
+    :return: The labeled column expressions.
+    """
+    fields = request.args.get("fields")
+    names = [name.strip() for name in fields.split(",")] if fields else default
+    unknown = sorted(set(names) - set(available))
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(unknown)}")
+
+    names = ["id", *(name for name in names if name != "id")]
+    return [available[name].label(name) for name in dict.fromkeys(names)]
+
+
+def page_size() -> int:
+    size = request.args.get("limit", type=int)
+    if size is None:
+        return current_app.config["LIBRARY_PAGE_SIZE"]
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def versioned_response(movie_id: int, load) -> Response:
+    """
+    Build the response of a movie resource with an ETag from the data
+    version of the movie, and answer a matching `If-None-Match` with 304
+    before loading anything.
+
+    :param movie_id: The ID of the movie.
+    :param load: Returns the response data, or None if it does not exist.
+    :return: The JSON response.
+    """
+    version = db_manager.get_movie_version(movie_id)
+    if version is None:
+        abort(404, "Movie not found.")
+
+    key = (request.endpoint, movie_id, version, tuple(request.args.items()))
+    etag = make_etag(key)
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+
+    data = load()
+    if data is None:
+        abort(404, "Movie not found.")
+    return json_response(data, etag=etag)
+
+
+def json_response(data, etag: str | None = None) -> Response:
+    """
+    Serialize data to a JSON response with a weak ETag, which is derived from
+    the body unless given. A matching `If-None-Match` is answered with 304.
+
+    :param data: JSON serializable data, datetimes are sent in ISO format.
+    :param etag: The ETag of the data.
+    :return: The response.
+    """
+    body = encode(data)
+    if etag is None:
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+
+    response = make_json_response(body)
+    response.set_etag(etag, weak=True)
+    # clients revalidate every time, the 304 keeps that cheap
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag: str) -> Response:
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def make_json_response(body: bytes, status: int = 200) -> Response:
+    """
+    Build a JSON response, gzip compressed if the client accepts it.
+
+    :param body: The encoded JSON body.
+    :param status: The status code.
+    :return: The response.
+    """
+    response = current_app.response_class(
+        body, status=status, mimetype="application/json"
+    )
+    response.vary.add("Accept-Encoding")
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.content_encoding = "gzip"
+    return response
+
+
+def encode(data) -> bytes:
+    return json.dumps(data, default=lambda value: value.isoformat()).encode()
@@ -13,16 +13,19 @@ from flask import (
     url_for,
 )
 from sqlalchemy.exc import IntegrityError
-from werkzeug.security import check_password_hash
 from werkzeug.wrappers.response import Response  # noqa: F811
 
-from movie_web import db_manager
-from movie_web.db_models import User, db
+from movie_web import db_manager, identity_cache, passwords
+from movie_web.db_models import User
+from movie_web.query_budget import query_budget
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 
 @bp.route("/register", methods=("GET", "POST"))
+# the INSERT plus BEGIN, SAVEPOINT and RELEASE of the savepoint
+@query_budget(4)
+@db_manager.transactional
 def register() -> Response | str:
     """
     Handle user registration.
@@ -43,10 +46,13 @@ def register() -> Response | str:
 
         if error is None:
             try:
-                db_manager.create_user(username, password)
+                # a savepoint, so a taken name only undoes this insert
+                with db_manager.transaction():
+                    db_manager.create_user(username, password)
             except IntegrityError:
                 error = f"User {username} is already registered."
-                db.session.rollback()
+            except passwords.PasswordHasherBusy as e:
+                error = str(e)
             else:
                 message = f"User {username} successfully created!"
                 flash(message=message, category="info")
@@ -58,6 +64,8 @@ def register() -> Response | str:
 
 
 @bp.route("/login", methods=("GET", "POST"))
+@query_budget(3)
+@db_manager.transactional
 def login() -> Response | str:
     """
     Handle user login.
@@ -73,14 +81,19 @@ def login() -> Response | str:
 
         user = db_manager.get_user_by_name(username)
 
-        if user is None:
-            error = "Incorrect username."
-        elif not check_password_hash(user.password, password):
-            error = "Incorrect password."
+        try:
+            if user is None:
+                error = "Incorrect username."
+            elif not passwords.verify_password(user.password, password):
+                error = "Incorrect password."
+        except passwords.PasswordHasherBusy as e:
+            error = str(e)
 
         if error is None:
             session.clear()
             session["user_id"] = user.id  # type: ignore
+            if passwords.needs_rehash(user.password):  # type: ignore
+                upgrade_password_hash(user, password)  # type: ignore
             return redirect(url_for("index"))
 
         flash(message=error, category="error")
@@ -88,10 +101,26 @@ def login() -> Response | str:
     return render_template("auth/login.html")
 
 
+def upgrade_password_hash(user: User, password: str) -> None:
+    """
+    Rehash a password with the current hash parameters after a successful
+    login. Skipped while the hasher is busy, the next login tries again.
+
+    :param user: The logged-in user.
+    :param password: The verified plain password.
+    """
+    try:
+        password_hash = passwords.hash_password(password)
+    except passwords.PasswordHasherBusy:
+        return
+    db_manager.update_user_password(user, password_hash)
+
+
 @bp.before_app_request
 def load_logged_in_user() -> None:
     """
-    Load the logged-in user into the global object.
+    Load the identity of the logged-in user into the global object, from the
+    identity cache if possible.
 
     :return: None
     """
@@ -99,11 +128,19 @@ def load_logged_in_user() -> None:
 
     if user_id is None:
         g.user = None
-    else:
-        g.user = db.session.get(User, user_id)
+        return
+
+    cache = identity_cache.get_cache()
+    identity = cache.get(user_id)
+    if identity is None:
+        identity = db_manager.get_user_identity(user_id)
+        if identity is not None:
+            cache.set(identity)
+    g.user = identity
 
 
 @bp.route("/logout")
+@query_budget(1)
 def logout() -> Response:
     """
     Log out the current user.
@@ -3,39 +3,145 @@ from datetime import datetime
 from flask import (
     Blueprint,
     abort,
+    current_app,
     flash,
     g,
     redirect,
     render_template,
     request,
+    session,
     url_for,
 )
+from sqlalchemy.orm import joinedload, selectinload
 from werkzeug import Response
 
 import movie_web.db_manager as db_manager
+import movie_web.movie_jobs as movie_jobs
 import movie_web.omdb_api as omdb_api
+import movie_web.posters as posters
 import movie_web.utils as utils
 from movie_web.auth import login_required
-from movie_web.db_models import User, db
+from movie_web.db_models import Movie, Review, User, db
+from movie_web.omdb_errors import MovieNotFoundError
+from movie_web.page_cache import cached_page
+from movie_web.query_budget import query_budget
 
 bp = Blueprint("blog", __name__)
 
+# Loader options per view. Everything a template touches is loaded with the
+# main query, so the number of queries per request does not grow with the
+# number of reviews or movies.
+LOADING_PROFILES = {
+    "movie_details": (
+        selectinload(Movie.reviews)
+        .joinedload(Review.user)
+        .load_only(User.id, User.user_name),
+    ),
+    "update_review": (joinedload(Review.movie),),
+}
+
 
 @bp.route("/")
+@query_budget(4)
 def index() -> str:
     """
-    Render the blog index page with the list of all movies.
+    Render the blog index page with one page of the user's movies.
+
+    The `after` query parameter is the cursor returned for the previous page.
+    The library can be filtered with the `genre` parameter, or the `person`
+    and `role` parameters.
 
     :return: A Flask response or rendered index template.
     :rtype: flask.Response
     """
     user = g.user
-    db_manager.get_all_movies()
-    return render_template("blog/index.html", user=user)
+    after_id = request.args.get("after", type=int)
+    filters = {
+        key: request.args[key]
+        for key in ("genre", "person", "role")
+        if request.args.get(key)
+    }
+    movies, next_cursor, genre_counts, jobs = [], None, [], []
+
+    if user is not None:
+        jobs = db_manager.get_user_movie_jobs(user.id)
+        movies, next_cursor = db_manager.get_user_movies_page(
+            user.id,
+            after_id=after_id,
+            page_size=current_app.config["LIBRARY_PAGE_SIZE"],
+            **filters,
+        )
+        # aggregates the whole library, so later pages keep the keyset cost
+        if after_id is None:
+            genre_counts = db_manager.get_user_genre_counts(user.id)
+
+    return render_template(
+        "blog/index.html",
+        user=user,
+        movies=movies,
+        after_id=after_id,
+        next_cursor=next_cursor,
+        filters=filters,
+        genre_counts=genre_counts,
+        jobs=jobs,
+        lookups_running=any(
+            job.status in db_manager.UNFINISHED_JOB_STATUSES for job in jobs
+        ),
+    )
+
+
+@bp.route("/job/<int:job_id>/dismiss", methods=("POST",))
+@query_budget(2)
+@login_required
+def dismiss_job(job_id: int) -> Response:
+    """
+    Remove a failed movie lookup from the index page.
+
+    :param job_id: The ID of the job.
+    :return: A redirect to the blog index page.
+    :rtype: flask.Response
+    """
+    if not db_manager.delete_movie_job(g.user.id, job_id):
+        abort(404)
+    return redirect(url_for("blog.index"))
+
+
+@bp.route("/search")
+@query_budget(2)
+@login_required
+def search() -> str:
+    """
+    Search the movie catalog.
+
+    The `q` query parameter holds the search text, `page` the result page.
+
+    :return: A rendered search template.
+    :rtype: str
+    """
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    page_size = current_app.config["SEARCH_PAGE_SIZE"]
+    movies = []
+
+    if query:
+        movies = db_manager.search_movies(
+            query, limit=page_size + 1, offset=(page - 1) * page_size
+        )
+
+    return render_template(
+        "blog/search.html",
+        query=query,
+        movies=movies[:page_size],
+        page=page,
+        has_next=len(movies) > page_size,
+    )
 
 
 @bp.route("/create", methods=("GET", "POST"))
+# 3 with job workers, the rest is the inline job with MOVIE_JOB_WORKERS = 0
+@query_budget(13)
 @login_required
+@db_manager.transactional
 def create() -> Response | str:
     """
     Handle the creation of a new movie entry.
@@ -52,45 +158,61 @@ def create() -> Response | str:
 
         if not (title or imdb_id):
             error = "You have to enter at least one field. Title or IMDB-ID"
-
-        if (
-            title
-            and title.lower()
-            in map(lambda movie: movie.title.lower(), g.user.movies)
-            and year in map(lambda movie: movie.year, g.user.movies)
-        ):
-            error = "Title already in your library"
-
-        elif imdb_id and imdb_id in map(
-            lambda movie: movie.imdb_id, g.user.movies
-        ):
-            error = "Title already in your library"
+        elif year and not year.isdigit():
+            error = "Year has to be a number"
 
         if error is not None:
             flash(message=error, category="error")
-        else:
-            requested_movie = omdb_api.get_movie(
-                title=title, year=year, imdb_id=imdb_id
-            )
+            return render_template("blog/create.html")
 
-            new_movie = db_manager.serialize_omdb_movie(requested_movie)
-            existing_movie = db_manager.get_movie_by_imdb_id(new_movie.imdb_id)  # type: ignore
+        # read before the commits below expire the loaded objects
+        user_id = g.user.id
 
-            if not existing_movie:
-                db_manager.add_movie(new_movie)
-                db_manager.add_movie_to_user(g.user, new_movie)
-            else:
-                db_manager.add_movie_to_user(g.user, existing_movie)
-            message = f"Movie {new_movie.title} added!"
-            flash(message=message, category="info")
+        # check the local catalog first, OMDB is only asked for new movies
+        movie, in_library = db_manager.find_catalog_movie(
+            user_id,
+            title=title,
+            year=int(year) if year else None,
+            imdb_id=imdb_id,
+        )
 
+        if movie is None and omdb_api.is_known_missing(title, year, imdb_id):
+            flash(
+                message=f"{title or imdb_id} not found on OMDB",
+                category="error",
+            )
+            return render_template("blog/create.html")
+
+        if movie is None:
+            # OMDB is asked by a job worker, the request returns right away
+            job = db_manager.create_movie_job(
+                user_id,
+                title=title,
+                year=int(year) if year else None,
+                imdb_id=imdb_id,
+            )
+            job_id, runner = job.id, movie_jobs.get_runner()
+            db_manager.on_commit(lambda: runner.submit(job_id))
+            flash(message=f"Looking up {title or imdb_id}...", category="info")
             return redirect(url_for("blog.index"))
 
+        if in_library:
+            flash(message="Title already in your library", category="error")
+            return render_template("blog/create.html")
+
+        message = f"Movie {movie.title} added!"
+        db_manager.add_movie_to_user(user_id, movie.id)
+        flash(message=message, category="info")
+
+        return redirect(url_for("blog.index"))
+
     return render_template("blog/create.html")
 
 
 @bp.route("/movie/<int:movie_id>")
+@query_budget(4)
 @login_required
+@cached_page(db_manager.get_movie_version)
 def movie_details(movie_id: int) -> str:
     """
     Show details of a specific movie.
@@ -100,16 +222,22 @@ def movie_details(movie_id: int) -> str:
     :return: A Flask response or rendered movie detail template.
     :rtype: flask.Response
     """
-    movie = db_manager.get_movie_by_id(movie_id)
+    movie = db_manager.get_movie_by_id(
+        movie_id, options=LOADING_PROFILES["movie_details"]
+    )
     if movie is None:
         abort(404)
 
     user_review = next(
-        (review for review in g.user.reviews if review.movie_id == movie_id),
+        (review for review in movie.reviews if review.user_id == g.user.id),
         None,
     )
     imdb_stars = utils.calculate_imdb_stars(movie.imdb_rating)  # type: ignore
-    genres = movie.genre.split(",")  # type: ignore
+    genres = db_manager.split_names(movie.genre)
+    people = {
+        key: db_manager.split_names(getattr(movie, key))
+        for key in db_manager.PERSON_ROLES
+    }
 
     return render_template(
         "blog/movie.html",
@@ -117,11 +245,15 @@ def movie_details(movie_id: int) -> str:
         user_review=user_review,
         stars=imdb_stars,
         genres=genres,
+        people=people,
+        person_roles=db_manager.PERSON_ROLES,
     )
 
 
 @bp.route("/movie/<int:movie_id>/update", methods=("GET", "POST"))
+@query_budget(9)
 @login_required
+@db_manager.transactional
 def update_movie(movie_id: int) -> Response | str:
     """
     Update a specific movie's details.
@@ -138,13 +270,21 @@ def update_movie(movie_id: int) -> Response | str:
 
     if request.method == "POST":
         error = db_manager.check_for_errors(request.form)
+        poster_link = request.form.get("poster_link", movie.poster_link)
+        # posters are downloaded by the server, so only from poster hosts
+        if (
+            error is None
+            and poster_link != movie.poster_link
+            and not posters.is_allowed_poster_link(poster_link)
+        ):
+            allowed = ", ".join(current_app.config["POSTER_HOSTS"])
+            error = f"Poster-Link has to be an https URL on {allowed}"
 
         if error is not None:
             flash(message=error, category="error")
         else:
             db_manager.update_movie(movie, request.form)
-            db.session.commit()
-            return redirect(url_for("blog.movie_details", movie_id=movie.id))  # type: ignore
+            return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
     return render_template(
         "blog/update.html",
@@ -154,7 +294,9 @@ def update_movie(movie_id: int) -> Response | str:
 
 
 @bp.route("/movie/<int:movie_id>/delete", methods=("POST",))
+@query_budget(3)
 @login_required
+@db_manager.transactional
 def delete_movie(movie_id: int) -> Response:
     """
     Delete a specific movie from the user's library.
@@ -168,17 +310,18 @@ def delete_movie(movie_id: int) -> Response:
     if movie is None:
         abort(404)
 
-    g.user.movies.remove(movie)
-    db.session.commit()
-
     message = f"{movie.title} deleted!"  # type: ignore
+    db_manager.remove_movie_from_user(g.user.id, movie_id)
+
     flash(message=message, category="delete")
 
     return redirect(url_for("blog.index"))
 
 
 @bp.route("/movie/<int:movie_id>/refresh", methods=("POST",))
+@query_budget(9)
 @login_required
+@db_manager.transactional
 def refresh_movie(movie_id: int) -> Response:
     """
     Refresh the movie data by fetching the latest data from OMDB API.
@@ -195,15 +338,21 @@ def refresh_movie(movie_id: int) -> Response:
     imdb_id = movie.imdb_id  # type: ignore
 
     requested_movie = omdb_api.get_movie(imdb_id=imdb_id)
-    refreshed_movie = db_manager.serialize_omdb_movie(requested_movie)
+    try:
+        refreshed_movie = db_manager.serialize_omdb_movie(requested_movie)
+    except MovieNotFoundError:
+        flash(message=f"{imdb_id} is no longer on OMDB", category="error")
+        return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
     db_manager.refresh_movie(movie, refreshed_movie)
 
-    return redirect(url_for("blog.movie_details", movie_id=movie.id))  # type: ignore
+    return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
 
 @bp.route("/movie/<int:movie_id>/review", methods=("GET", "POST"))
+@query_budget(3)
 @login_required
+@db_manager.transactional
 def add_review(movie_id: int) -> Response | str:
     """
     Add a review for a specific movie.
@@ -217,11 +366,24 @@ def add_review(movie_id: int) -> Response | str:
     if movie is None:
         abort(404)
 
+    if request.method == "GET":
+        user_review = db_manager.get_review_by_user_and_movie(
+            g.user.id, movie_id
+        )
+        if user_review is not None:
+            return redirect(
+                url_for("blog.update_review", review_id=user_review.id)
+            )
+
     if request.method == "POST":
-        new_review = db_manager.create_review(g.user, movie_id)
+        new_review = db_manager.create_review(g.user.id, movie_id)
+        user_name = g.user.user_name
 
-        db_manager.add_review(new_review)
-        flash(f"New Review by {g.user.user_name} created!", category="info")
+        if db_manager.add_review(new_review):
+            message = f"New Review by {user_name} created!"
+        else:
+            message = f"Review by {user_name} updated!"
+        flash(message, category="info")
 
         return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
@@ -229,7 +391,9 @@ def add_review(movie_id: int) -> Response | str:
 
 
 @bp.route("/review/<int:review_id>/update", methods=("GET", "POST"))
+@query_budget(3)
 @login_required
+@db_manager.transactional
 def update_review(review_id: int) -> Response | str:
     """
     Update a specific movie review.
@@ -239,19 +403,20 @@ def update_review(review_id: int) -> Response | str:
     :return: A Flask response or rendered review update template.
     :rtype: flask.Response
     """
-    review = db_manager.get_review_by_id(review_id)
+    review = db_manager.get_review_by_id(
+        review_id, options=LOADING_PROFILES["update_review"]
+    )
     if review is None:
         abort(404)
 
-    movie = db_manager.get_movie_by_id(review.movie_id)
+    movie = review.movie
     g.now = datetime.now()
 
     if request.method == "POST":
+        movie_id = review.movie_id
         db_manager.update_review(review)
 
-        return redirect(
-            url_for("blog.movie_details", movie_id=review.movie_id)  # type: ignore
-        )
+        return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
     return render_template(
         "blog/update_review.html", review=review, movie=movie
@@ -259,7 +424,9 @@ def update_review(review_id: int) -> Response | str:
 
 
 @bp.route("/review/<int:review_id>/delete", methods=("POST",))
+@query_budget(3)
 @login_required
+@db_manager.transactional
 def delete_review(review_id: int) -> Response:
     """
     Delete a specific movie review.
@@ -274,15 +441,18 @@ def delete_review(review_id: int) -> Response:
     if review is None:
         abort(404)
 
-    db_manager.delete_review(review)
+    movie_id = review.movie_id
     message = f"Deleted Review from {g.user.user_name}!"
+
+    db_manager.delete_review(review)
     flash(message, category="delete")
 
-    return redirect(url_for("blog.movie_details", movie_id=review.movie_id))  # type: ignore
+    return redirect(url_for("blog.movie_details", movie_id=movie_id))
 
 
 @bp.route("/user/<int:user_id>/delete", methods=("POST",))
 @login_required
+@db_manager.transactional
 def delete_user(user_id) -> Response:
     """
     Delete a user from the system.
@@ -293,12 +463,16 @@ def delete_user(user_id) -> Response:
     :rtype: flask.Response
     """
     user = db.session.get(User, user_id)
+    if user is None:
+        abort(404)
 
     user_name = user.user_name  # type: ignore
     if user.id != g.user.id:  # type: ignore
         abort(403)
 
     db_manager.delete_user(user)  # type: ignore
+    # user IDs are reused, the session must not log into the next user
+    session.clear()
     message = f"User {user_name} successfully deleted!"
     flash(message, category="delete")
 
@@ -0,0 +1,245 @@
+"""
+Flask CLI commands for maintaining the movie catalog.
+
+Usage:
+    flask --app movie_web import-movies movies.txt
+    flask --app movie_web refresh-movies
+"""
+
+import csv
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, NamedTuple, TextIO
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from requests import RequestException
+from sqlalchemy.exc import IntegrityError
+
+import movie_web.db_manager as db_manager
+import movie_web.omdb_api as omdb_api
+from movie_web import posters, refresher
+from movie_web.db_models import Movie, db
+
+IMDB_ID_PATTERN = re.compile(r"^tt\d+$")
+
+# importer threads wait for the shared rate limit instead of failing
+IMPORT_RATE_LIMIT_WAIT = 60
+
+
+class ImportEntry(NamedTuple):
+    title: str | None = None
+    year: str | None = None
+    imdb_id: str | None = None
+
+
+def register_commands(app) -> None:
+    """
+    Register the CLI commands of the app.
+
+    :param app: The Flask application object.
+    """
+    app.cli.add_command(import_movies_command)
+    app.cli.add_command(refresh_movies_command)
+    app.cli.add_command(reconcile_reviews_command)
+    app.cli.add_command(fetch_posters_command)
+
+
+@click.command("import-movies")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--workers", default=8, show_default=True, help="Concurrent OMDB requests."
+)
+@click.option(
+    "--batch-size",
+    default=100,
+    show_default=True,
+    help="Movies inserted per transaction.",
+)
+@with_appcontext
+def import_movies_command(file: TextIO, workers: int, batch_size: int) -> None:
+    """
+    Import movies listed in FILE from OMDB.
+
+    Each line holds an IMDb ID (tt0468569) or a CSV title and optional year
+    ("The Dark Knight",2008). Empty lines and lines starting with # are
+    skipped, as are movies which are already in the catalog.
+    """
+    existing_ids = db_manager.get_all_imdb_ids()
+    entries = [
+        entry
+        for entry in dict.fromkeys(read_import_file(file))
+        if entry.imdb_id not in existing_ids
+    ]
+    click.echo(f"Importing {len(entries)} entries with {workers} workers...")
+
+    client = omdb_api.get_client()
+    imported = skipped = failed = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start : start + batch_size]
+            movies = []
+
+            for entry, result in zip(
+                batch, executor.map(lambda e: fetch_movie(client, e), batch)
+            ):
+                if isinstance(result, Exception):
+                    failed += 1
+                    click.echo(f"Failed {format_entry(entry)}: {result}", err=True)
+                elif result.imdb_id in existing_ids:
+                    skipped += 1
+                else:
+                    existing_ids.add(result.imdb_id)
+                    movies.append(result)
+
+            imported += insert_movies(movies)
+            click.echo(
+                f"{start + len(batch)}/{len(entries)} processed, "
+                f"{imported} imported, {skipped} skipped, {failed} failed"
+            )
+
+    click.echo("Import finished.")
+
+
+@click.command("refresh-movies")
+@click.option(
+    "--max-age",
+    type=float,
+    help="Refresh movies older than this many seconds. "
+    "Defaults to MOVIE_REFRESH_MAX_AGE.",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    help="Movies committed per transaction. "
+    "Defaults to MOVIE_REFRESH_BATCH_SIZE.",
+)
+@with_appcontext
+def refresh_movies_command(max_age: float | None, batch_size: int | None) -> None:
+    """
+    Fetch stale movies from OMDB again and store changed columns.
+    """
+    result = refresher.refresh_stale_movies(
+        max_age=max_age or current_app.config["MOVIE_REFRESH_MAX_AGE"],
+        batch_size=batch_size or current_app.config["MOVIE_REFRESH_BATCH_SIZE"],
+    )
+    click.echo(
+        f"{result.checked} movies checked, {result.changed} changed, "
+        f"{result.failed} failed"
+    )
+
+
+@click.command("reconcile-reviews")
+@with_appcontext
+def reconcile_reviews_command() -> None:
+    """
+    Recompute the review count and average rating of all movies.
+    """
+    reviewed = db_manager.reconcile_review_stats()
+    db.session.commit()
+    click.echo(f"Review stats of {reviewed} reviewed movies recomputed")
+
+
+@click.command("fetch-posters")
+@click.option(
+    "--batch-size", default=50, show_default=True, help="Movies per query."
+)
+@with_appcontext
+def fetch_posters_command(batch_size: int) -> None:
+    """
+    Download the posters of all movies which have no stored poster yet.
+    """
+    store = posters.get_store()
+    stored = failed = 0
+    after_id = None
+
+    while movies := db_manager.get_movies_without_posters(after_id, batch_size):
+        after_id = movies[-1].id
+        for movie in movies:
+            try:
+                names = store.download(movie.poster_link)
+            except (RequestException, posters.InvalidPosterError) as e:
+                click.echo(f"Failed: {movie.poster_link} ({e})", err=True)
+                failed += 1
+                continue
+            db_manager.set_movie_posters(movie.id, movie.poster_link, **names)
+            stored += 1
+
+    click.echo(f"{stored} posters stored, {failed} failed")
+
+
+def read_import_file(file: TextIO) -> Iterator[ImportEntry]:
+    """
+    Parse an import file into entries.
+
+    :param file: The opened import file.
+    :return: An iterator of import entries.
+    """
+    for row in csv.reader(file):
+        if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+            continue
+
+        value = row[0].strip()
+        if len(row) == 1 and IMDB_ID_PATTERN.match(value):
+            yield ImportEntry(imdb_id=value)
+        else:
+            year = row[1].strip() if len(row) > 1 else None
+            yield ImportEntry(title=value, year=year or None)
+
+
+def fetch_movie(
+    client: omdb_api.OmdbClient, entry: ImportEntry
+) -> Movie | Exception:
+    """
+    Fetch and serialize a single movie. Runs on an importer thread.
+
+    :param client: The shared OMDB client.
+    :param entry: The entry to fetch.
+    :return: The serialized movie, or the exception raised while fetching it.
+    """
+    try:
+        omdb_response = client.get_movie(
+            title=entry.title,
+            year=entry.year,
+            imdb_id=entry.imdb_id,
+            rate_limit_wait=IMPORT_RATE_LIMIT_WAIT,
+        )
+        return db_manager.serialize_omdb_movie(omdb_response)
+    except (ValueError, RequestException) as e:
+        return e
+
+
+def insert_movies(movies: list[Movie]) -> int:
+    """
+    Insert a batch of movies in one transaction. If the batch conflicts with
+    movies added in the meantime, the movies are inserted one by one.
+    Pending movies are expunged on rollback, so they can be added again.
+
+    :param movies: The movies to insert.
+    :return: The number of inserted movies.
+    """
+    if not movies:
+        return 0
+
+    try:
+        db_manager.add_movies(movies)
+        return len(movies)
+    except IntegrityError:
+        db.session.rollback()
+
+    inserted = 0
+    for movie in movies:
+        try:
+            db_manager.add_movie(movie)
+            inserted += 1
+        except IntegrityError:
+            db.session.rollback()
+    return inserted
+
+
+def format_entry(entry: ImportEntry) -> str:
+    if entry.imdb_id:
+        return entry.imdb_id
+    return f"{entry.title} ({entry.year})" if entry.year else str(entry.title)
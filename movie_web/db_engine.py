@@ -0,0 +1,72 @@
+"""
+SQLite engine profile.
+
+Every new SQLite connection gets the pragmas from the `SQLITE_PRAGMAS` setting.
+The defaults switch to WAL mode, so readers no longer block the writer and
+concurrent workers wait for locks instead of failing with
+"database is locked".
+"""
+
+from sqlalchemy import event
+
+from movie_web.db_models import db
+
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,  # milliseconds
+    "cache_size": -32000,  # negative values are KiB
+    "mmap_size": 128 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+DEFAULT_ENGINE_OPTIONS = {
+    "pool_size": 10,
+    "max_overflow": 10,
+    "pool_timeout": 10,
+    "connect_args": {"timeout": 5},  # seconds, the driver's busy handler
+}
+
+
+def apply_pragmas(dbapi_connection, pragmas: dict) -> None:
+    """
+    Set pragmas on a raw SQLite connection.
+
+    :param dbapi_connection: The sqlite3 connection.
+    :param pragmas: Pragma names and values.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def register_pragmas(engine, pragmas: dict) -> None:
+    """
+    Apply pragmas to every new connection of an engine.
+
+    :param engine: The SQLAlchemy engine.
+    :param pragmas: Pragma names and values.
+    """
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+def init_app(app) -> None:
+    """
+    Apply the `SQLITE_PRAGMAS` of the app to its database engine.
+
+    Must run before the first connection is opened.
+
+    :param app: The Flask application object.
+    """
+    with app.app_context():
+        engine = db.engine
+
+    if engine.dialect.name == "sqlite":
+        register_pragmas(engine, app.config["SQLITE_PRAGMAS"])
@@ -1,17 +1,178 @@
+import functools
+import re
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Sequence
+from typing import Callable, Iterable, Iterator, Sequence
 
 from flask import request
-from sqlalchemy import select
+from sqlalchemy import (
+    column,
+    delete,
+    exists,
+    func,
+    inspect,
+    literal,
+    literal_column,
+    or_,
+    select,
+    table,
+    update,
+)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import load_only
+from sqlalchemy.orm.interfaces import ORMOption
 
 # from sqlalchemy.exc import IntegrityError
-from sqlalchemy.inspection import inspect
-from werkzeug.security import generate_password_hash
 
 # from movie_web import dummy_data, omdb_api
-from movie_web.db_models import Movie, Review, User, db
+from movie_web import identity_cache, passwords
+from movie_web.db_models import (
+    Genre,
+    Movie,
+    MovieGenre,
+    MovieJob,
+    MoviePerson,
+    Person,
+    Review,
+    User,
+    UserMovie,
+    db,
+)
+from movie_web.omdb_errors import MovieNotFoundError, is_not_found
+
+REQUIRED_MOVIE_KEYS = [
+    "title",
+    "year",
+    "genre",
+    "imdb_id",
+    "stars",
+    "director",
+    "writer",
+    "plot",
+    "poster_link",
+    "imdb_rating",
+]
+
+# FTS5 index created by db_schema, not part of the ORM metadata
+movie_fts = table("movie_fts", column("rowid"), column("movie_fts"))
+
+# BM25 weights of title, plot, stars, director and writer
+SEARCH_RANK = literal_column("bm25(movie_fts, 10.0, 1.0, 4.0, 4.0, 2.0)")
+
+MAX_SEARCH_TERMS = 10
+
+# movie jobs which are not finished yet, see movie_jobs
+UNFINISHED_JOB_STATUSES = ("pending", "running")
+
+# comma-joined movie columns with people and the role stored in movie_person
+PERSON_ROLES = {"stars": "star", "director": "director", "writer": "writer"}
+FACET_KEYS = ("genre", *PERSON_ROLES)
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """
+    Unit of work for several `db_manager` operations.
+
+    Helpers called inside the scope flush instead of committing, and the
+    outermost scope commits once at its end or rolls back on an error.
+    Nested scopes are savepoints: an error inside them only undoes their own
+    changes, and the enclosing scope can handle it and continue.
+
+    Usage:
+        with db_manager.transaction():
+            db_manager.refresh_movie(movie, refreshed_movie)
+            db_manager.add_movie_to_user(user_id, movie.id)
+
+    :raises Exception: Any error of the scope, after the rollback.
+    """
+    info = db.session.info
+    depth = info.get("transaction_depth", 0)
+    if depth:
+        queued = len(info.get("after_commit", []))
+        _begin_driver_transaction()
+        info["transaction_depth"] = depth + 1
+        try:
+            with db.session.begin_nested():
+                yield
+        except BaseException:
+            # callbacks of the rolled back savepoint
+            del info.get("after_commit", [])[queued:]
+            raise
+        finally:
+            info["transaction_depth"] = depth
+        return
+
+    info["transaction_depth"] = 1
+    try:
+        yield
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+    finally:
+        info["transaction_depth"] = 0
+        callbacks = info.pop("after_commit", [])
+    # outside of the scope, so callbacks may commit on their own
+    for callback in callbacks:
+        callback()
+
+
+def transactional(view: Callable) -> Callable:
+    """
+    Decorator which runs a view in a `transaction`, so all its writes are
+    committed together after the view returned.
+
+    :param view: The view function to wrap.
+    :return: Wrapped view function.
+    """
+
+    @functools.wraps(view)
+    def wrapped_view(**kwargs):
+        with transaction():
+            return view(**kwargs)
+
+    return wrapped_view
+
+
+def in_transaction() -> bool:
+    return db.session.info.get("transaction_depth", 0) > 0
+
+
+def commit() -> None:
+    """
+    Commit the session, or only flush it inside a `transaction`, which
+    commits at its end.
+    """
+    if in_transaction():
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def on_commit(callback: Callable[[], None]) -> None:
+    """
+    Run a callback once the changes are committed, e.g. to invalidate a
+    cache. Runs immediately outside of a `transaction`, and not at all if the
+    transaction is rolled back.
+
+    :param callback: Called without arguments.
+    """
+    if in_transaction():
+        db.session.info.setdefault("after_commit", []).append(callback)
+    else:
+        callback()
 
-REQUIRED_MOVIE_KEYS = [column.key for column in inspect(Movie).attrs][3:]  # type: ignore
+
+def _begin_driver_transaction() -> None:
+    # pysqlite only sends BEGIN before the first INSERT, UPDATE or DELETE,
+    # and releasing a SAVEPOINT outside of a transaction would commit it
+    connection = db.session.connection()
+    dbapi_connection = connection.connection.dbapi_connection
+    if connection.dialect.name == "sqlite" and not getattr(
+        dbapi_connection, "in_transaction", True
+    ):
+        connection.exec_driver_sql("BEGIN")
 
 
 def get_user_by_name(name: str) -> User | None:
@@ -26,6 +187,18 @@ def get_user_by_name(name: str) -> User | None:
     return user
 
 
+def get_user_identity(user_id: int) -> identity_cache.UserIdentity | None:
+    """
+    Load the id and name of a user without creating an ORM object.
+
+    :param user_id: The ID of the user.
+    :return: The identity if the user exists, otherwise None.
+    """
+    stmt = select(User.id, User.user_name).where(User.id == user_id)
+    row = db.session.execute(stmt).first()
+    return identity_cache.UserIdentity(*row) if row else None
+
+
 def get_all_movies() -> Sequence[Movie]:
     """
     Get all movies from the database, ordered by movie ID.
@@ -36,38 +209,469 @@ def get_all_movies() -> Sequence[Movie]:
     return db.session.execute(stmt).scalars().all()
 
 
+def get_user_movies_page(
+    user_id: int,
+    after_id: int | None = None,
+    page_size: int = 24,
+    genre: str | None = None,
+    person: str | None = None,
+    role: str | None = None,
+) -> tuple[Sequence[Movie], int | None]:
+    """
+    Get one page of a user's library using keyset pagination, optionally
+    filtered by genre or person.
+
+    The page is read from the (user_id, movie_id) primary key of `user_movie`,
+    so every page costs the same regardless of its position. Filters are
+    checked per movie on the primary keys of `movie_genre` and
+    `movie_person`. Only the columns needed for the library listing are
+    loaded.
+
+    :param user_id: The ID of the user.
+    :param after_id: Return movies with an ID greater than this one.
+    :param page_size: The maximum number of movies per page.
+    :param genre: Only return movies of this genre.
+    :param person: Only return movies with this star, director or writer.
+    :param role: Only match the person in this role, e.g. "director".
+    :return: The movies of the page and the cursor of the next page, or None
+        if this is the last page.
+    """
+    stmt = select(Movie).options(
+        load_only(
+            Movie.id,
+            Movie.title,
+            Movie.year,
+            Movie.poster_link,
+            Movie.poster_thumb,
+        )
+    )
+    stmt = _user_movies_page(
+        stmt, user_id, after_id, page_size, genre, person, role
+    )
+
+    movies = db.session.execute(stmt).scalars().all()
+    next_cursor = movies[page_size - 1].id if len(movies) > page_size else None
+    return movies[:page_size], next_cursor
+
+
+def get_user_movie_rows(
+    user_id: int,
+    columns: Sequence,
+    after_id: int | None = None,
+    page_size: int = 24,
+    genre: str | None = None,
+    person: str | None = None,
+    role: str | None = None,
+) -> tuple[list[dict], int | None]:
+    """
+    Get one page of a user's library like `get_user_movies_page`, but only
+    select the given columns and return plain rows.
+
+    :param user_id: The ID of the user.
+    :param columns: Labeled `Movie` column expressions, must include the ID
+        as "id".
+    :param after_id: Return movies with an ID greater than this one.
+    :param page_size: The maximum number of movies per page.
+    :param genre: Only return movies of this genre.
+    :param person: Only return movies with this star, director or writer.
+    :param role: Only match the person in this role, e.g. "director".
+    :return: The rows of the page as dictionaries and the cursor of the next
+        page, or None if this is the last page.
+    """
+    stmt = _user_movies_page(
+        select(*columns), user_id, after_id, page_size, genre, person, role
+    )
+    rows = [dict(row) for row in db.session.execute(stmt).mappings()]
+    next_cursor = rows[page_size - 1]["id"] if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+
+def _user_movies_page(
+    stmt,
+    user_id: int,
+    after_id: int | None,
+    page_size: int,
+    genre: str | None,
+    person: str | None,
+    role: str | None,
+):
+    stmt = (
+        stmt.select_from(Movie)
+        .join(UserMovie, UserMovie.movie_id == Movie.id)
+        .where(UserMovie.user_id == user_id)
+        .order_by(UserMovie.movie_id)
+        .limit(page_size + 1)
+    )
+    if after_id is not None:
+        stmt = stmt.where(UserMovie.movie_id > after_id)
+    if genre:
+        stmt = stmt.where(
+            exists()
+            .where(MovieGenre.movie_id == UserMovie.movie_id)
+            .where(MovieGenre.genre_id == Genre.id, Genre.name == genre)
+        )
+    if person:
+        person_filter = (
+            exists()
+            .where(MoviePerson.movie_id == UserMovie.movie_id)
+            .where(MoviePerson.person_id == Person.id, Person.name == person)
+        )
+        if role:
+            person_filter = person_filter.where(MoviePerson.role == role)
+        stmt = stmt.where(person_filter)
+    return stmt
+
+
+def get_user_genre_counts(user_id: int) -> list[tuple[str, int]]:
+    """
+    Count the movies per genre in a user's library.
+
+    :param user_id: The ID of the user.
+    :return: Genre names and movie counts, most common genre first.
+    """
+    count = func.count(MovieGenre.movie_id)
+    stmt = (
+        select(Genre.name, count)
+        .select_from(UserMovie)
+        .join(MovieGenre, MovieGenre.movie_id == UserMovie.movie_id)
+        .join(Genre, Genre.id == MovieGenre.genre_id)
+        .where(UserMovie.user_id == user_id)
+        .group_by(Genre.id)
+        .order_by(count.desc(), Genre.name)
+    )
+    return [(name, total) for name, total in db.session.execute(stmt)]
+
+
+def search_movies(
+    query: str, limit: int = 24, offset: int = 0
+) -> Sequence[Movie]:
+    """
+    Search the catalog by title, plot, stars, director and writer.
+
+    Every word of the query has to match the start of a word in the movie.
+    Results are ranked with BM25, title matches weigh the most.
+
+    :param query: The search text entered by the user.
+    :param limit: The maximum number of movies to return.
+    :param offset: The number of best matches to skip.
+    :return: A sequence of Movie objects, best match first.
+    """
+    match = build_search_query(query)
+    if not match:
+        return []
+
+    stmt = (
+        select(Movie)
+        .join(movie_fts, movie_fts.c.rowid == Movie.id)
+        .where(movie_fts.c.movie_fts.op("MATCH")(match))
+        .order_by(SEARCH_RANK)
+        .limit(limit)
+        .offset(offset)
+        .options(
+            load_only(
+                Movie.id,
+                Movie.title,
+                Movie.year,
+                Movie.poster_link,
+                Movie.poster_thumb,
+            )
+        )
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def build_search_query(query: str) -> str:
+    """
+    Turn user input into an FTS5 query of quoted prefix terms, so operators
+    and quotes in the input cannot break the query.
+
+    :param query: The search text entered by the user.
+    :return: The FTS5 query, or an empty string if there is nothing to search.
+    """
+    terms = re.findall(r"\w+", query)[:MAX_SEARCH_TERMS]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
 def add_movie(movie: Movie) -> None:
     """
-    Add a movie to the database.
+    Add a movie with its genres and people to the database.
 
     :param movie: The movie object to be added.
     """
     db.session.add(movie)
-    db.session.commit()
+    sync_movie_facets([movie])
+    commit()
 
 
-def add_movie_to_user(user: User, movie: Movie) -> None:
+def add_movies(movies: Iterable[Movie]) -> None:
     """
-    Add a movie to a user's movie list.
+    Add several movies with their genres and people to the database in a
+    single transaction.
 
-    :param user: The user object to which the movie will be added.
-    :param movie: The movie object to be added.
+    :param movies: The movie objects to be added.
+    """
+    movies = list(movies)
+    db.session.add_all(movies)
+    sync_movie_facets(movies)
+    commit()
+
+
+def add_new_movie_to_user(user_id: int, movie: Movie) -> None:
+    """
+    Add a new movie with its genres and people to the database and to a
+    user's movie list in a single transaction.
+
+    :param user_id: The ID of the user.
+    :param movie: The new movie object.
+    """
+    db.session.add(movie)
+    sync_movie_facets([movie])
+    # the movie has no ID yet if it has no genres or people
+    db.session.flush()
+    db.session.add(UserMovie(user_id=user_id, movie_id=movie.id))
+    commit()
+
+
+def split_names(value: str | None) -> list[str]:
+    """
+    Split a comma-joined OMDB column like "Drama, Crime" into names.
+
+    Notes like "(screenplay)" and the "N/A" placeholder are dropped.
+
+    :param value: The column value.
+    :return: The names in their original order, without duplicates.
+    """
+    names: list[str] = []
+    for name in (value or "").split(","):
+        name = re.sub(r"\s*\(.*?\)", "", name).strip()
+        if name and name != "N/A" and name not in names:
+            names.append(name)
+    return names
+
+
+def sync_movie_facets(movies: Sequence[Movie]) -> None:
+    """
+    Rebuild the `movie_genre` and `movie_person` rows of movies from their
+    genre, stars, director and writer columns.
+
+    Missing genres and people are created. All movies are handled with a
+    fixed number of statements. The changes are committed by the caller.
+
+    :param movies: The movie objects, pending movies are flushed.
+    """
+    if not movies:
+        return
+    # pending movies have no rows to replace
+    stored_ids = [movie.id for movie in movies if not inspect(movie).pending]
+
+    genre_ids = _get_or_create_ids(
+        Genre, {name for movie in movies for name in split_names(movie.genre)}
+    )
+    person_ids = _get_or_create_ids(
+        Person,
+        {
+            name
+            for movie in movies
+            for key in PERSON_ROLES
+            for name in split_names(getattr(movie, key))
+        },
+    )
+
+    if stored_ids:
+        db.session.execute(
+            delete(MovieGenre).where(MovieGenre.movie_id.in_(stored_ids))
+        )
+        db.session.execute(
+            delete(MoviePerson).where(MoviePerson.movie_id.in_(stored_ids))
+        )
+
+    movie_genres = [
+        {"movie_id": movie.id, "genre_id": genre_ids[name]}
+        for movie in movies
+        for name in split_names(movie.genre)
+    ]
+    movie_people = [
+        {"movie_id": movie.id, "person_id": person_ids[name], "role": role}
+        for movie in movies
+        for key, role in PERSON_ROLES.items()
+        for name in split_names(getattr(movie, key))
+    ]
+    if movie_genres:
+        db.session.execute(insert(MovieGenre), movie_genres)
+    if movie_people:
+        db.session.execute(insert(MoviePerson), movie_people)
+
+
+def _get_or_create_ids(model, names: set[str]) -> dict[str, int]:
+    # a single upsert returns the IDs of existing and new rows
+    if not names:
+        return {}
+    stmt = insert(model).values([{"name": name} for name in names])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[model.name], set_={"name": stmt.excluded.name}
+    ).returning(model.name, model.id)
+    return {name: model_id for name, model_id in db.session.execute(stmt)}
+
+
+def get_all_imdb_ids() -> set[str]:
+    """
+    Get the IMDb IDs of all movies in the database with a single query.
+
+    :return: A set of IMDb IDs.
     """
-    user.movies.append(movie)
-    db.session.commit()
+    stmt = select(Movie.imdb_id)
+    return set(db.session.execute(stmt).scalars())
 
 
-def get_movie_by_id(movie_id: int) -> Movie | None:
+def add_movie_to_user(user_id: int, movie_id: int) -> None:
+    """
+    Add a movie to a user's movie list without loading the list.
+
+    :param user_id: The ID of the user to which the movie will be added.
+    :param movie_id: The ID of the movie to be added.
+    """
+    db.session.add(UserMovie(user_id=user_id, movie_id=movie_id))  # type: ignore
+    commit()
+
+
+def remove_movie_from_user(user_id: int, movie_id: int) -> None:
+    """
+    Remove a movie from a user's movie list without loading the list.
+
+    :param user_id: The ID of the user.
+    :param movie_id: The ID of the movie to be removed.
+    """
+    stmt = delete(UserMovie).where(
+        UserMovie.user_id == user_id, UserMovie.movie_id == movie_id
+    )
+    db.session.execute(stmt)
+    commit()
+
+
+def add_movies_to_user(user_id: int, movie_ids: Iterable[int]) -> int:
+    """
+    Add several movies to a user's movie list with a single statement.
+    Unknown movies and movies already in the list are skipped.
+
+    :param user_id: The ID of the user.
+    :param movie_ids: The IDs of the movies to be added.
+    :return: The number of added movies.
+    """
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return 0
+    stmt = (
+        insert(UserMovie)
+        .from_select(
+            ["user_id", "movie_id"],
+            select(literal(user_id), Movie.id).where(Movie.id.in_(movie_ids)),
+        )
+        .on_conflict_do_nothing()
+    )
+    added = db.session.execute(stmt).rowcount
+    commit()
+    return added
+
+
+def remove_movies_from_user(user_id: int, movie_ids: Iterable[int]) -> int:
+    """
+    Remove several movies from a user's movie list with a single statement.
+
+    :param user_id: The ID of the user.
+    :param movie_ids: The IDs of the movies to be removed.
+    :return: The number of removed movies.
+    """
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return 0
+    stmt = delete(UserMovie).where(
+        UserMovie.user_id == user_id, UserMovie.movie_id.in_(movie_ids)
+    )
+    removed = db.session.execute(stmt).rowcount
+    commit()
+    return removed
+
+
+def get_movie_by_id(
+    movie_id: int, options: Sequence[ORMOption] = ()
+) -> Movie | None:
     """
     Get a movie by its ID.
 
     :param movie_id: The ID of the movie.
+    :param options: Loader options, e.g. for eager loading relationships.
     :return: The movie object if found, otherwise None.
     """
-    return db.session.get(Movie, movie_id)
+    return db.session.get(Movie, movie_id, options=options)
+
+
+def get_movie_row(movie_id: int, columns: Sequence) -> dict | None:
+    """
+    Get the given columns of a movie.
+
+    :param movie_id: The ID of the movie.
+    :param columns: Labeled `Movie` column expressions.
+    :return: The row as a dictionary, or None if the movie does not exist.
+    """
+    stmt = select(*columns).where(Movie.id == movie_id)
+    row = db.session.execute(stmt).mappings().first()
+    return dict(row) if row is not None else None
+
+
+def get_movie_version(movie_id: int) -> int | None:
+    """
+    Get the data version of a movie, which changes with its page content.
+
+    :param movie_id: The ID of the movie.
+    :return: The data version, or None if the movie does not exist.
+    """
+    stmt = select(Movie.data_version).where(Movie.id == movie_id)
+    return db.session.scalar(stmt)
+
+
+def find_catalog_movie(
+    user_id: int,
+    title: str | None = None,
+    year: int | None = None,
+    imdb_id: str | None = None,
+) -> tuple[Movie | None, bool]:
+    """
+    Look up a movie in the catalog and whether it is in a user's library with
+    a single query.
+
+    The IMDb ID takes priority over the title, like in the OMDB request. Titles
+    are compared case-insensitively using the `ix_movie_title_year` index. A
+    title without a year only matches if it is unique in the catalog.
+
+    :param user_id: The ID of the user.
+    :param title: The movie title.
+    :param year: The release year.
+    :param imdb_id: The IMDb ID.
+    :return: The movie, or None if there is no unambiguous match, and whether
+        it is in the user's library.
+    """
+    stmt = select(Movie, UserMovie.user_id).outerjoin(
+        UserMovie,
+        (UserMovie.movie_id == Movie.id) & (UserMovie.user_id == user_id),
+    )
+    if imdb_id:
+        stmt = stmt.where(Movie.imdb_id == imdb_id)
+    elif title:
+        stmt = stmt.where(func.lower(Movie.title) == func.lower(title.strip()))
+        if year is not None:
+            stmt = stmt.where(Movie.year == year)
+    else:
+        return None, False
+
+    rows = db.session.execute(stmt.limit(2)).all()
+    if len(rows) != 1:
+        return None, False
+
+    movie, library_user_id = rows[0]
+    return movie, library_user_id is not None
 
 
-def get_movie_by_imdb_id(imdb_id: int) -> Movie | None:
+def get_movie_by_imdb_id(imdb_id: str) -> Movie | None:
     """
     Get a movie by its IMDb ID.
 
@@ -80,27 +684,163 @@ def get_movie_by_imdb_id(imdb_id: int) -> Movie | None:
 
 def update_movie(movie: Movie, form_data) -> None:
     """
-    Update the attributes of a movie with form data.
+    Update the attributes of a movie with form data, and its genres and
+    people if they changed.
 
     :param movie: The movie object to update.
     :param form_data: The form data containing new values.
     """
     data = form_data.to_dict()
+    facets_changed = any(
+        key in data and data[key] != getattr(movie, key) for key in FACET_KEYS
+    )
+    if data.get("poster_link", movie.poster_link) != movie.poster_link:
+        clear_movie_posters(movie)
     for key, value in data.items():
         setattr(movie, key, value)
+    if facets_changed:
+        sync_movie_facets([movie])
 
 
-def refresh_movie(movie: Movie, refreshed_movie: Movie) -> None:
+def refresh_movie(movie: Movie, refreshed_movie: Movie) -> list[str]:
     """
     Refresh a movie's data with the latest information.
 
+    Only changed columns are written.
+
+    :param movie: The movie object to update.
+    :param refreshed_movie: The new movie data to apply.
+    :return: The names of the changed columns.
+    """
+    changed_keys = apply_movie_changes(movie, refreshed_movie)
+    movie.last_fetched = refreshed_movie.last_fetched or datetime.now(
+        timezone.utc
+    )
+    commit()
+    return changed_keys
+
+
+def apply_movie_changes(movie: Movie, refreshed_movie: Movie) -> list[str]:
+    """
+    Copy the values of a refreshed movie which differ from the stored ones,
+    and update its genres and people if they changed.
+
     :param movie: The movie object to update.
     :param refreshed_movie: The new movie data to apply.
+    :return: The names of the changed columns.
     """
+    changed_keys = []
     for key in REQUIRED_MOVIE_KEYS:
         value = getattr(refreshed_movie, key)
-        setattr(movie, key, value)
-    db.session.commit()
+        if getattr(movie, key) != value:
+            setattr(movie, key, value)
+            changed_keys.append(key)
+    if "poster_link" in changed_keys:
+        clear_movie_posters(movie)
+    if any(key in changed_keys for key in FACET_KEYS):
+        sync_movie_facets([movie])
+    return changed_keys
+
+
+def clear_movie_posters(movie: Movie) -> None:
+    """
+    Forget the stored poster variants of a movie, so the new poster link is
+    downloaded.
+
+    :param movie: The movie object.
+    """
+    movie.poster_thumb = None
+    movie.poster_full = None
+
+
+def set_movie_posters(
+    movie_id: int, poster_link: str, thumb: str, full: str
+) -> bool:
+    """
+    Store the file names of downloaded poster variants, unless the poster
+    link of the movie changed during the download.
+
+    :param movie_id: The ID of the movie.
+    :param poster_link: The downloaded poster URL.
+    :param thumb: The file name of the thumbnail.
+    :param full: The file name of the full variant.
+    :return: True if the movie was updated.
+    """
+    stmt = (
+        update(Movie)
+        .where(Movie.id == movie_id, Movie.poster_link == poster_link)
+        .values(poster_thumb=thumb, poster_full=full)
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(stmt)
+    commit()
+    return result.rowcount > 0
+
+
+def get_movies_without_posters(
+    after_id: int | None, limit: int
+) -> Sequence[Movie]:
+    """
+    Get movies whose poster was not stored yet, ordered by ID.
+
+    :param after_id: Return movies with an ID greater than this one.
+    :param limit: The maximum number of movies to return.
+    :return: A sequence of Movie objects.
+    """
+    stmt = (
+        select(Movie)
+        .where(Movie.poster_full.is_(None), Movie.poster_link != "N/A")
+        .order_by(Movie.id)
+        .limit(limit)
+        .options(load_only(Movie.id, Movie.poster_link))
+    )
+    if after_id is not None:
+        stmt = stmt.where(Movie.id > after_id)
+    return db.session.execute(stmt).scalars().all()
+
+
+def get_stale_movies(fetched_before: datetime, limit: int) -> Sequence[Movie]:
+    """
+    Get movies whose OMDB data was fetched before a point in time, oldest
+    first. Movies which were never fetched come first.
+
+    :param fetched_before: Movies fetched before this time are stale.
+    :param limit: The maximum number of movies to return.
+    :return: A sequence of Movie objects.
+    """
+    stmt = (
+        select(Movie)
+        .where(
+            or_(
+                Movie.last_fetched.is_(None),
+                Movie.last_fetched < fetched_before,
+            )
+        )
+        .order_by(Movie.last_fetched.nulls_first(), Movie.id)
+        .limit(limit)
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def mark_movies_fetched(movie_ids: Iterable[int], fetched: datetime) -> None:
+    """
+    Set the last fetched time of several movies with a single UPDATE.
+
+    The change is committed by the caller.
+
+    :param movie_ids: The IDs of the movies.
+    :param fetched: The time the movies were fetched.
+    """
+    movie_ids = list(movie_ids)
+    if not movie_ids:
+        return
+    stmt = (
+        update(Movie)
+        .where(Movie.id.in_(movie_ids))
+        .values(last_fetched=fetched)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(stmt)
 
 
 def check_for_errors(form_data) -> str | None:
@@ -129,10 +869,13 @@ def serialize_omdb_movie(omdb_response: dict) -> Movie:
 
     :param omdb_response: The OMDB API response as a dictionary.
     :return: A Movie object populated with the OMDB data.
+    :raises MovieNotFoundError: If OMDB does not know the movie.
     :raises ValueError: If required fields are missing in the response.
     """
     if not omdb_response:
         raise ValueError("OMDB response is empty!")
+    if is_not_found(omdb_response):
+        raise MovieNotFoundError(omdb_response["Error"])
 
     # Extract and transform data
     poster = omdb_response.get("Poster")
@@ -154,6 +897,7 @@ def serialize_omdb_movie(omdb_response: dict) -> Movie:
         "plot": omdb_response.get("Plot"),
         "poster_link": poster,
         "imdb_rating": float(imdb_rating),  # Convert Rating to float
+        "last_fetched": datetime.now(timezone.utc),
     }
 
     # Ensure required fields are present
@@ -171,14 +915,68 @@ def serialize_omdb_movie(omdb_response: dict) -> Movie:
     return new_movie
 
 
-def get_review_by_id(review_id: int) -> Review | None:
+def get_review_by_id(
+    review_id: int, options: Sequence[ORMOption] = ()
+) -> Review | None:
     """
     Retrieve a review by its ID.
 
     :param review_id: The ID of the review.
+    :param options: Loader options, e.g. for eager loading relationships.
     :return: The review object if found, otherwise None.
     """
-    return db.session.get(Review, review_id)
+    return db.session.get(Review, review_id, options=options)
+
+
+def get_review_by_user_and_movie(
+    user_id: int, movie_id: int
+) -> Review | None:
+    """
+    Retrieve the review of a user for a movie using the
+    `ix_review_user_movie` index.
+
+    :param user_id: The ID of the user.
+    :param movie_id: The ID of the movie.
+    :return: The review object if found, otherwise None.
+    """
+    stmt = select(Review).where(
+        Review.user_id == user_id, Review.movie_id == movie_id
+    )
+    return db.session.scalar(stmt)
+
+
+def get_movie_review_rows(
+    movie_id: int,
+    columns: Sequence,
+    after_id: int | None = None,
+    page_size: int = 24,
+) -> tuple[list[dict], int | None]:
+    """
+    Get one page of the reviews of a movie using keyset pagination on the
+    `ix_review_movie` index, with only the given columns.
+
+    :param movie_id: The ID of the movie.
+    :param columns: Labeled `Review` and `User` column expressions, must
+        include the review ID as "id".
+    :param after_id: Return reviews with an ID greater than this one.
+    :param page_size: The maximum number of reviews per page.
+    :return: The rows of the page as dictionaries and the cursor of the next
+        page, or None if this is the last page.
+    """
+    stmt = (
+        select(*columns)
+        .select_from(Review)
+        .join(User, User.id == Review.user_id)
+        .where(Review.movie_id == movie_id)
+        .order_by(Review.id)
+        .limit(page_size + 1)
+    )
+    if after_id is not None:
+        stmt = stmt.where(Review.id > after_id)
+
+    rows = [dict(row) for row in db.session.execute(stmt).mappings()]
+    next_cursor = rows[page_size - 1]["id"] if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
 
 
 def create_review(user_id: int, movie_id: int) -> Review:
@@ -198,14 +996,97 @@ def create_review(user_id: int, movie_id: int) -> Review:
     )
 
 
-def add_review(review: Review) -> None:
+def add_review(review: Review) -> bool:
     """
-    Add a review to the database.
+    Add a review to the database. If the user already reviewed the movie,
+    the existing review is updated instead.
 
     :param review: The review object to be added.
+    :return: True if a new review was created, False if one was updated.
+    """
+    stmt = insert(Review).values(
+        user_id=review.user_id,
+        movie_id=review.movie_id,
+        text=review.text,
+        rating=review.rating,
+        created=review.created or datetime.now(timezone.utc),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Review.user_id, Review.movie_id],
+        set_={
+            "text": stmt.excluded.text,
+            "rating": stmt.excluded.rating,
+            "updated": stmt.excluded.created,
+        },
+    )
+    # only the update branch sets the updated column
+    updated = db.session.execute(stmt.returning(Review.updated)).scalar_one()
+    commit()
+    return updated is None
+
+
+def import_reviews(user_id: int, reviews: Sequence[dict]) -> list[int]:
+    """
+    Add or update several reviews of a user in a single transaction, with
+    one upsert for all of them. The review stats and data versions of the
+    movies are updated by the database triggers.
+
+    :param user_id: The ID of the user.
+    :param reviews: Dictionaries with "movie_id", "rating" and optionally
+        "text", one per movie.
+    :return: The IDs of the reviewed movies, reviews of unknown movies are
+        skipped.
+    """
+    movie_ids = {review["movie_id"] for review in reviews}
+    if not movie_ids:
+        return []
+    stmt = select(Movie.id).where(Movie.id.in_(movie_ids))
+    known_ids = set(db.session.execute(stmt).scalars())
+
+    now = datetime.now(timezone.utc)
+    rows = {
+        review["movie_id"]: {
+            "user_id": user_id,
+            "movie_id": review["movie_id"],
+            "text": review.get("text"),
+            "rating": review["rating"],
+            "created": now,
+        }
+        for review in reviews
+        if review["movie_id"] in known_ids
+    }
+    if rows:
+        stmt = insert(Review).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Review.user_id, Review.movie_id],
+            set_={
+                "text": stmt.excluded.text,
+                "rating": stmt.excluded.rating,
+                "updated": stmt.excluded.created,
+            },
+        )
+        db.session.execute(stmt)
+    commit()
+    return sorted(rows)
+
+
+def delete_user_reviews(user_id: int, movie_ids: Iterable[int]) -> int:
     """
-    db.session.add(review)
-    db.session.commit()
+    Delete the reviews of a user for several movies with a single statement.
+
+    :param user_id: The ID of the user.
+    :param movie_ids: The IDs of the reviewed movies.
+    :return: The number of deleted reviews.
+    """
+    movie_ids = set(movie_ids)
+    if not movie_ids:
+        return 0
+    stmt = delete(Review).where(
+        Review.user_id == user_id, Review.movie_id.in_(movie_ids)
+    )
+    deleted = db.session.execute(stmt).rowcount
+    commit()
+    return deleted
 
 
 def update_review(review: Review) -> None:
@@ -217,7 +1098,7 @@ def update_review(review: Review) -> None:
     data = request.form.to_dict()
     for key, value in data.items():
         setattr(review, key, value)
-    db.session.commit()
+    commit()
 
 
 def delete_review(review: Review) -> None:
@@ -227,7 +1108,40 @@ def delete_review(review: Review) -> None:
     :param review: The review object to be deleted.
     """
     db.session.delete(review)
-    db.session.commit()
+    commit()
+
+
+def reconcile_review_stats() -> int:
+    """
+    Recompute the review count and rating sum of all movies from the review
+    table with a single GROUP BY, e.g. after the triggers were bypassed.
+
+    The change is committed by the caller.
+
+    :return: The number of movies with reviews.
+    """
+    stats = (
+        select(
+            Review.movie_id,
+            func.count(Review.id).label("review_count"),
+            func.sum(Review.rating).label("rating_sum"),
+        )
+        .group_by(Review.movie_id)
+        .subquery()
+    )
+    db.session.execute(
+        update(Movie)
+        .where(Movie.review_count != 0)
+        .values(review_count=0, rating_sum=0)
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        update(Movie)
+        .where(Movie.id == stats.c.movie_id)
+        .values(review_count=stats.c.review_count, rating_sum=stats.c.rating_sum)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
 
 
 def create_user(username: str, password: str) -> User:
@@ -237,23 +1151,186 @@ def create_user(username: str, password: str) -> User:
     :param username: The username for the new user.
     :param password: The password for the new user.
     :return: The created user object.
+    :raises passwords.PasswordHasherBusy: If too many passwords are hashed.
     """
-    hashed_pw = generate_password_hash(password)
+    hashed_pw = passwords.hash_password(password)
     new_user = User(user_name=username, password=hashed_pw)  # type: ignore
     db.session.add(new_user)
-    db.session.commit()
+    db.session.flush()
+    user_id = new_user.id
+    commit()
 
+    # the ID may belong to a deleted user which is still cached
+    on_commit(lambda: identity_cache.get_cache().invalidate(user_id))
     return new_user
 
 
+def update_user_password(user: User, password_hash: str) -> None:
+    """
+    Replace the password hash of a user, e.g. after a rehash on login.
+
+    :param user: The user object.
+    :param password_hash: The new password hash.
+    """
+    user.password = password_hash
+    commit()
+
+
 def delete_user(user: User) -> None:
     """
     Delete a user from the database.
 
     :param user: The user object to be deleted.
     """
+    user_id = user.id
     db.session.delete(user)
-    db.session.commit()
+    commit()
+    on_commit(lambda: identity_cache.get_cache().invalidate(user_id))
+
+
+def create_movie_job(
+    user_id: int,
+    title: str | None = None,
+    year: int | None = None,
+    imdb_id: str | None = None,
+) -> MovieJob:
+    """
+    Queue the lookup of a movie for a user's library.
+
+    :param user_id: The ID of the user.
+    :param title: The movie title.
+    :param year: The release year.
+    :param imdb_id: The IMDb ID.
+    :return: The pending job.
+    """
+    job = MovieJob(
+        user_id=user_id,  # type: ignore
+        title=title or None,  # type: ignore
+        year=year,  # type: ignore
+        imdb_id=imdb_id or None,  # type: ignore
+    )
+    db.session.add(job)
+    commit()
+    return job
+
+
+def get_movie_job(job_id: int) -> MovieJob | None:
+    return db.session.get(MovieJob, job_id)
+
+
+def get_user_movie_jobs(user_id: int) -> Sequence[MovieJob]:
+    """
+    Get the unfinished and failed movie jobs of a user, oldest first.
+
+    :param user_id: The ID of the user.
+    :return: The jobs.
+    """
+    stmt = (
+        select(MovieJob)
+        .where(
+            MovieJob.user_id == user_id,
+            MovieJob.status.in_((*UNFINISHED_JOB_STATUSES, "failed")),
+        )
+        .order_by(MovieJob.id)
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def claim_movie_job(job_id: int) -> MovieJob | None:
+    """
+    Mark a pending job as running. Only one worker can claim a job, even
+    across processes.
+
+    :param job_id: The ID of the job.
+    :return: The claimed job, or None if it was not pending.
+    """
+    stmt = (
+        update(MovieJob)
+        .where(MovieJob.id == job_id, MovieJob.status == "pending")
+        .values(status="running", updated=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    claimed = db.session.execute(stmt).rowcount
+    commit()
+    if not claimed:
+        return None
+    return db.session.get(MovieJob, job_id, populate_existing=True)
+
+
+def finish_movie_job(
+    job: MovieJob, movie_id: int | None = None, error: str | None = None
+) -> None:
+    """
+    Mark a job as done, or as failed if there is an error.
+
+    :param job: The running job.
+    :param movie_id: The ID of the added movie.
+    :param error: The message shown to the user if the job failed.
+    """
+    job.status = "failed" if error else "done"
+    job.movie_id = movie_id
+    job.error = error
+    job.updated = datetime.now(timezone.utc)
+    commit()
+
+
+def delete_movie_job(user_id: int, job_id: int) -> bool:
+    """
+    Delete a finished job of a user, e.g. to dismiss a failure.
+
+    :param user_id: The ID of the user.
+    :param job_id: The ID of the job.
+    :return: True if the job was deleted.
+    """
+    stmt = delete(MovieJob).where(
+        MovieJob.id == job_id,
+        MovieJob.user_id == user_id,
+        MovieJob.status.not_in(UNFINISHED_JOB_STATUSES),
+    )
+    deleted = db.session.execute(stmt).rowcount
+    commit()
+    return deleted > 0
+
+
+def get_pending_movie_job_ids() -> list[int]:
+    stmt = (
+        select(MovieJob.id)
+        .where(MovieJob.status == "pending")
+        .order_by(MovieJob.id)
+    )
+    return list(db.session.execute(stmt).scalars())
+
+
+def expire_movie_jobs(
+    running_before: datetime, finished_before: datetime
+) -> None:
+    """
+    Fail jobs which are running for too long, e.g. because their worker
+    died, and delete old finished jobs.
+
+    :param running_before: Fail jobs which started before this time.
+    :param finished_before: Delete jobs which finished before this time.
+    """
+    db.session.execute(
+        update(MovieJob)
+        .where(
+            MovieJob.status == "running",
+            MovieJob.updated < running_before,
+        )
+        .values(
+            status="failed",
+            error="The lookup was interrupted, please try again.",
+            updated=datetime.now(timezone.utc),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        delete(MovieJob).where(
+            MovieJob.status.not_in(UNFINISHED_JOB_STATUSES),
+            MovieJob.updated < finished_before,
+        )
+    )
+    commit()
 
 
 # def populate_dummy_data() -> None:
@@ -308,11 +1385,3 @@ def delete_user(user: User) -> None:
 #                 print(
 #                     f"Error adding review for movie {review_data['movie_id']} by user {review_data['user_id']}. Skipping..."
 #                 )
-
-
-# def get_review_by_user_and_movie(user_id, movie_id):
-#     return (
-#         db.session.query(Review)
-#         .filter_by(user_id=user_id, movie_id=movie_id)
-#         .first()
-#     )
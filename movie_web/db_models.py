@@ -2,7 +2,8 @@ from datetime import datetime, timezone
 from typing import List, Optional
 
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import CheckConstraint, ForeignKey, String
+from sqlalchemy import CheckConstraint, ForeignKey, Index, String, func
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 
@@ -42,7 +43,16 @@ class Movie(db.Model):
     writer: Mapped[str]
     plot: Mapped[str]
     poster_link: Mapped[str]
+    # file names of the stored poster variants, see posters
+    poster_thumb: Mapped[Optional[str]]
+    poster_full: Mapped[Optional[str]]
     imdb_rating: Mapped[float]
+    last_fetched: Mapped[Optional[datetime]] = mapped_column(index=True)
+    # review aggregates, maintained by triggers on the review table
+    review_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    rating_sum: Mapped[float] = mapped_column(default=0, server_default="0")
+    # bumped by triggers when the movie page changes, see page_cache
+    data_version: Mapped[int] = mapped_column(default=0, server_default="0")
 
     # Relationships
     users: Mapped[List["User"]] = relationship(
@@ -51,6 +61,72 @@ class Movie(db.Model):
     reviews: Mapped[List["Review"]] = relationship(
         "Review", back_populates="movie", cascade="all, delete-orphan"
     )
+    # normalized copies of the comma-joined columns, see MovieGenre and
+    # MoviePerson
+    genres: Mapped[List["Genre"]] = relationship(
+        "Genre", secondary="movie_genre", viewonly=True
+    )
+
+    @hybrid_property
+    def avg_rating(self) -> float | None:
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    @avg_rating.inplace.expression
+    @classmethod
+    def _avg_rating_expression(cls):
+        return cls.rating_sum / func.nullif(cls.review_count, 0)
+
+
+# case-insensitive duplicate lookup by title and year
+Index("ix_movie_title_year", func.lower(Movie.title), Movie.year)
+
+
+class Genre(db.Model):
+    __tablename__ = "genre"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+
+
+class Person(db.Model):
+    __tablename__ = "person"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+
+
+class MovieGenre(db.Model):
+    __tablename__ = "movie_genre"
+    movie_id: Mapped[int] = mapped_column(
+        ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True
+    )
+    genre_id: Mapped[int] = mapped_column(
+        ForeignKey("genre.id"), primary_key=True
+    )
+
+    __table_args__ = (
+        # movies of a genre
+        Index("ix_movie_genre_genre", "genre_id", "movie_id"),
+    )
+
+
+class MoviePerson(db.Model):
+    __tablename__ = "movie_person"
+    movie_id: Mapped[int] = mapped_column(
+        ForeignKey("movie.id", ondelete="CASCADE"), primary_key=True
+    )
+    person_id: Mapped[int] = mapped_column(
+        ForeignKey("person.id"), primary_key=True
+    )
+    # "star", "director" or "writer"
+    role: Mapped[str] = mapped_column(String(10), primary_key=True)
+
+    __table_args__ = (
+        # movies of a person in a role
+        Index("ix_movie_person_person", "person_id", "role", "movie_id"),
+    )
 
 
 class Review(db.Model):
@@ -64,7 +140,7 @@ class Review(db.Model):
         CheckConstraint("rating >= 0 AND rating <= 5")
     )
     created: Mapped[datetime] = mapped_column(
-        default=datetime.now(timezone.utc)
+        default=lambda: datetime.now(timezone.utc)
     )
     updated: Mapped[Optional[datetime]]
 
@@ -72,6 +148,13 @@ class Review(db.Model):
     user: Mapped["User"] = relationship("User", back_populates="reviews")
     movie: Mapped["Movie"] = relationship("Movie", back_populates="reviews")
 
+    __table_args__ = (
+        # one review per user and movie
+        Index("ix_review_user_movie", "user_id", "movie_id", unique=True),
+        # reviews of a movie in order, for the movie page and the API
+        Index("ix_review_movie", "movie_id", "id"),
+    )
+
     def __repr__(self) -> str:
         return f"Review(id={self.id!r}, rating={self.rating!r})"
 
@@ -84,3 +167,36 @@ class UserMovie(db.Model):
     movie_id: Mapped[int] = mapped_column(
         ForeignKey("movie.id"), primary_key=True
     )
+
+
+class MovieJob(db.Model):
+    """
+    A movie lookup which `movie_jobs` runs in the background: pending,
+    running, done or failed.
+    """
+
+    __tablename__ = "movie_job"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("user.id", ondelete="CASCADE")
+    )
+    title: Mapped[Optional[str]]
+    year: Mapped[Optional[int]]
+    imdb_id: Mapped[Optional[str]]
+    status: Mapped[str] = mapped_column(String(10), default="pending")
+    error: Mapped[Optional[str]]
+    movie_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("movie.id", ondelete="SET NULL")
+    )
+    created: Mapped[datetime] = mapped_column(
+        default=lambda: datetime.now(timezone.utc)
+    )
+    updated: Mapped[Optional[datetime]]
+
+    __table_args__ = (
+        # unfinished jobs of a user for the index page
+        Index("ix_movie_job_user_status", "user_id", "status"),
+        # jobs to resume or expire at startup
+        Index("ix_movie_job_status", "status", "updated"),
+    )
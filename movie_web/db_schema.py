@@ -0,0 +1,203 @@
+"""
+Schema upgrades for existing databases.
+
+`db.create_all()` only creates missing tables. This module adds the columns
+and indexes which were introduced after a database was created, so an
+existing `movie_web.sqlite` keeps working without a migration tool. It also
+creates the FTS5 search index and the triggers for review aggregates and page
+versions, which SQLAlchemy does not manage, and runs data migrations which
+fill new tables and columns from existing rows.
+"""
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateIndex
+
+import movie_web.db_manager as db_manager
+from movie_web.db_models import Movie, db
+
+# columns added to existing tables: {table: {column: column definition}}
+ADDED_COLUMNS = {
+    "movie": {
+        "last_fetched": "DATETIME",
+        "review_count": "INTEGER NOT NULL DEFAULT 0",
+        "rating_sum": "FLOAT NOT NULL DEFAULT 0",
+        "data_version": "INTEGER NOT NULL DEFAULT 0",
+        "poster_thumb": "VARCHAR",
+        "poster_full": "VARCHAR",
+    },
+}
+
+
+# full-text index over the movie table, kept in sync by triggers
+SEARCH_COLUMNS = ("title", "plot", "stars", "director", "writer")
+_columns = ", ".join(SEARCH_COLUMNS)
+_new_values = ", ".join(f"new.{column}" for column in SEARCH_COLUMNS)
+_old_values = ", ".join(f"old.{column}" for column in SEARCH_COLUMNS)
+SEARCH_INDEX = [
+    f"CREATE VIRTUAL TABLE movie_fts USING fts5({_columns}, "
+    "content='movie', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS movie_fts_insert AFTER INSERT ON movie BEGIN "
+    f"INSERT INTO movie_fts (rowid, {_columns}) VALUES (new.id, {_new_values}); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS movie_fts_delete AFTER DELETE ON movie BEGIN "
+    f"INSERT INTO movie_fts (movie_fts, rowid, {_columns}) "
+    f"VALUES ('delete', old.id, {_old_values}); "
+    "END",
+    # only fires when an indexed column changes
+    f"CREATE TRIGGER IF NOT EXISTS movie_fts_update AFTER UPDATE OF {_columns} "
+    "ON movie BEGIN "
+    f"INSERT INTO movie_fts (movie_fts, rowid, {_columns}) "
+    f"VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO movie_fts (rowid, {_columns}) VALUES (new.id, {_new_values}); "
+    "END",
+    # index the movies which existed before the index
+    "INSERT INTO movie_fts (movie_fts) VALUES ('rebuild')",
+]
+
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def backfill_movie_facets() -> None:
+    """
+    Fill the genre and person tables from the movies which existed before
+    them.
+    """
+    last_id = 0
+    while True:
+        stmt = (
+            select(Movie)
+            .where(Movie.id > last_id)
+            .order_by(Movie.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        )
+        movies = db.session.execute(stmt).scalars().all()
+        if not movies:
+            break
+        db_manager.sync_movie_facets(movies)
+        last_id = movies[-1].id
+        db.session.expunge_all()
+
+
+def dedupe_reviews() -> None:
+    """
+    Keep only the latest review of a user for a movie, so the unique index
+    on reviews can be created.
+    """
+    result = db.session.execute(
+        text(
+            "DELETE FROM review WHERE id NOT IN "
+            "(SELECT MAX(id) FROM review GROUP BY user_id, movie_id)"
+        )
+    )
+    # the stats of older databases were computed with the duplicates
+    if result.rowcount:
+        db_manager.reconcile_review_stats()
+
+
+# data migrations, each runs once per database in this order. The number of
+# applied migrations is stored in SQLite's user_version. They run before the
+# indexes are created, so they may make rows satisfy new unique indexes.
+DATA_MIGRATIONS = [
+    backfill_movie_facets,
+    db_manager.reconcile_review_stats,
+    dedupe_reviews,
+]
+
+# per-movie review aggregates, updated in the transaction which changes a
+# review, including the cascade deletes of a user's reviews
+REVIEW_STATS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS review_stats_insert AFTER INSERT ON review "
+    "BEGIN "
+    "UPDATE movie SET review_count = review_count + 1, "
+    "rating_sum = rating_sum + new.rating WHERE id = new.movie_id; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS review_stats_delete AFTER DELETE ON review "
+    "BEGIN "
+    "UPDATE movie SET review_count = review_count - 1, "
+    "rating_sum = rating_sum - old.rating WHERE id = old.movie_id; "
+    "END",
+    # also fires for the update branch of the review upsert
+    "CREATE TRIGGER IF NOT EXISTS review_stats_update "
+    "AFTER UPDATE OF rating, movie_id ON review BEGIN "
+    "UPDATE movie SET review_count = review_count - 1, "
+    "rating_sum = rating_sum - old.rating WHERE id = old.movie_id; "
+    "UPDATE movie SET review_count = review_count + 1, "
+    "rating_sum = rating_sum + new.rating WHERE id = new.movie_id; "
+    "END",
+]
+
+# bump the data version of a movie when its page content changes, which
+# invalidates its cached pages
+PAGE_COLUMNS = (*db_manager.REQUIRED_MOVIE_KEYS, "poster_full")
+_bump_version = "UPDATE movie SET data_version = data_version + 1"
+MOVIE_VERSION_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS movie_version_update "
+    f"AFTER UPDATE OF {', '.join(PAGE_COLUMNS)} ON movie BEGIN "
+    f"{_bump_version} WHERE id = new.id; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS movie_version_review_insert "
+    "AFTER INSERT ON review BEGIN "
+    f"{_bump_version} WHERE id = new.movie_id; "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS movie_version_review_update "
+    "AFTER UPDATE ON review BEGIN "
+    f"{_bump_version} WHERE id IN (old.movie_id, new.movie_id); "
+    "END",
+    "CREATE TRIGGER IF NOT EXISTS movie_version_review_delete "
+    "AFTER DELETE ON review BEGIN "
+    f"{_bump_version} WHERE id = old.movie_id; "
+    "END",
+]
+
+
+def upgrade_schema() -> None:
+    """
+    Add missing columns, indexes and the search index to the database of the
+    current app and run pending data migrations.
+
+    Needs an application context. Safe to run on every start.
+    """
+    inspector = inspect(db.engine)
+    table_names = inspector.get_table_names()
+
+    with db.engine.begin() as connection:
+        for table, columns in ADDED_COLUMNS.items():
+            if table not in table_names:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for name, definition in columns.items():
+                if name not in existing:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE "{table}" ADD COLUMN {name} {definition}'
+                    )
+
+    run_data_migrations()
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+        if "movie_fts" not in table_names:
+            for statement in SEARCH_INDEX:
+                connection.exec_driver_sql(statement)
+
+        for statement in REVIEW_STATS_TRIGGERS + MOVIE_VERSION_TRIGGERS:
+            connection.exec_driver_sql(statement)
+
+
+def run_data_migrations() -> None:
+    """
+    Run the data migrations which were not applied to the database yet, in a
+    single transaction.
+    """
+    version = db.session.execute(text("PRAGMA user_version")).scalar() or 0
+    if version >= len(DATA_MIGRATIONS):
+        return
+
+    for migration in DATA_MIGRATIONS[version:]:
+        migration()
+    db.session.execute(text(f"PRAGMA user_version = {len(DATA_MIGRATIONS)}"))
+    db.session.commit()
@@ -2,6 +2,8 @@ from typing import Any
 
 from flask import render_template
 
+from movie_web import metrics
+
 ERROR_MESSAGES = {
     400: "Oops! It looks like something went wrong with your request. Please try again.",
     401: "You need to log in to access this page. Please authenticate and try again.",
@@ -9,6 +11,7 @@ ERROR_MESSAGES = {
     404: "The page you're looking for doesn't exist. Check the URL or go back to the homepage.",
     405: "It seems like you're trying to access this page with the wrong method. Please try again using the correct action.",
     500: "Our server ran into a problem. Please try again later or contact support.",
+    503: "The movie database is not reachable right now. Please try again in a few minutes.",
     "default": "An unexpected error occurred. Please try again or contact support.",
 }
 
@@ -42,6 +45,7 @@ def render_error_page(e) -> tuple[str, Any | int]:
     """
     """Generic error page renderer."""
     code = getattr(e, "code", 500)
+    metrics.ERRORS.inc(code=str(code))
     error_msg = ERROR_MESSAGES.get(code, ERROR_MESSAGES["default"])
     return render_template(
         "error/error.html", error_code=code, error_msg=error_msg
@@ -0,0 +1,96 @@
+"""
+Per-process cache of logged-in user identities.
+
+`auth.load_logged_in_user` runs before every request. It reads the id and
+user name of the session user from this cache instead of loading the `User`
+row, so most requests skip that query. Entries expire after `USER_CACHE_TTL`
+seconds and are dropped when a user is created or deleted in this process.
+Other worker processes notice a deleted user after the TTL at the latest.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from flask import current_app
+
+
+class UserIdentity(NamedTuple):
+    """
+    The columns of a user which every request needs. Views which need the
+    relationships of a user load the `User` row themselves.
+    """
+
+    id: int
+    user_name: str
+
+
+class IdentityCache:
+    """
+    Thread-safe LRU map of user identities with a TTL.
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 1024) -> None:
+        """
+        :param ttl: Seconds until a cached identity expires, 0 disables the
+            cache.
+        :param max_entries: Maximum number of identities kept in memory.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._identities: OrderedDict[int, tuple[float, UserIdentity]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> UserIdentity | None:
+        """
+        :param user_id: The ID of the user.
+        :return: The cached identity or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._identities.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._identities.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._identities.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, identity: UserIdentity) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._identities[identity.id] = (time.monotonic(), identity)
+            self._identities.move_to_end(identity.id)
+            while len(self._identities) > self.max_entries:
+                self._identities.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._identities.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._identities.clear()
+
+
+def init_app(app) -> None:
+    """
+    Create the identity cache of the app from its configuration.
+
+    :param app: The Flask application object.
+    """
+    app.extensions["identity_cache"] = IdentityCache(
+        ttl=app.config["USER_CACHE_TTL"],
+        max_entries=app.config["USER_CACHE_SIZE"],
+    )
+
+
+def get_cache() -> IdentityCache:
+    return current_app.extensions["identity_cache"]
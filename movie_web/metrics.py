@@ -0,0 +1,326 @@
+"""
+Prometheus metrics.
+
+A small in-process registry of counters and histograms, exposed in the
+Prometheus text format at `/metrics`. It records:
+
+- latency and status of requests to the views of `METRICS_BLUEPRINTS`,
+- SQL statements and their duration per request, from SQLAlchemy engine
+  events,
+- OMDB request latency, outcomes, retries and cache lookups (`omdb_api`),
+- rendered error pages by status code (`error`).
+
+Every worker process has its own registry, so scrape each worker or run a
+single process per container. `/metrics` answers requests with
+`Authorization: Bearer <METRICS_TOKEN>`, and local requests only with
+`METRICS_ALLOW_LOCAL`; everything else, and every request without either
+setting, is denied.
+
+Usage:
+    REQUESTS = Counter("name_total", "Help text.", ("label",))
+    REQUESTS.inc(label="value")
+"""
+
+import bisect
+import hmac
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    g,
+    has_request_context,
+    request,
+)
+from sqlalchemy import event
+
+from movie_web.db_models import db
+
+# addresses allowed to scrape without a token with METRICS_ALLOW_LOCAL
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+# histogram upper bounds in seconds and statements
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+bp = Blueprint("metrics", __name__)
+
+
+class Metric(ABC):
+    """
+    Base class of metrics with label values.
+    """
+
+    kind = ""
+
+    def __init__(
+        self, name: str, description: str, labelnames: Iterable[str] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{escape(value)}"'
+            for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    @abstractmethod
+    def collect(self) -> list[str]:
+        """
+        :return: The sample lines of the metric in the text format.
+        """
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(
+        self, name: str, description: str, labelnames: Iterable[str] = ()
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{self._format_labels(key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # per label values: bucket counts (last one is +Inf), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0)
+            )
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total))
+                for key, (counts, total) in self._values.items()
+            )
+        lines = []
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else format_value(bound)
+                labels = self._format_labels(key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = self._format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def escape(value: str) -> str:
+    value = value.replace("\\", "\\\\").replace("\n", "\\n")
+    return value.replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+REGISTRY: list[Metric] = []
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by endpoint.",
+    ("endpoint", "method"),
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "HTTP requests by endpoint and status code.",
+    ("endpoint", "method", "status"),
+)
+ERRORS = Counter(
+    "http_errors_total",
+    "Rendered error pages by status code.",
+    ("code",),
+)
+SQL_STATEMENTS = Histogram(
+    "sql_statements_per_request",
+    "SQL statements issued per request by endpoint.",
+    ("endpoint",),
+    buckets=STATEMENT_BUCKETS,
+)
+SQL_REQUEST_TIME = Histogram(
+    "sql_request_duration_seconds",
+    "Time spent executing SQL per request by endpoint.",
+    ("endpoint",),
+)
+SQL_DURATION = Histogram(
+    "sql_statement_duration_seconds",
+    "Duration of single SQL statements.",
+)
+OMDB_LATENCY = Histogram(
+    "omdb_request_duration_seconds",
+    "Latency of OMDB requests including retries.",
+)
+OMDB_REQUESTS = Counter(
+    "omdb_requests_total",
+    "OMDB requests by outcome, e.g. ok, timeout or http_503.",
+    ("outcome",),
+)
+OMDB_RETRIES = Counter(
+    "omdb_retries_total",
+    "Retried OMDB requests.",
+)
+OMDB_CACHE = Counter(
+    "omdb_cache_lookups_total",
+    "OMDB response cache lookups by result.",
+    ("result",),
+)
+
+
+def init_app(app) -> None:
+    """
+    Record request and SQL metrics of the app and serve `/metrics`.
+
+    :param app: The Flask application object.
+    """
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _start_statement)
+    event.listen(engine, "after_cursor_execute", _end_statement)
+
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.register_blueprint(bp)
+
+
+def _start_statement(
+    conn, cursor, statement, parameters, context, executemany
+):
+    conn.info["metrics_started"] = time.perf_counter()
+
+
+def _end_statement(
+    conn, cursor, statement, parameters, context, executemany
+):
+    started = conn.info.pop("metrics_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    SQL_DURATION.observe(duration)
+    if has_request_context():
+        g.sql_count = g.get("sql_count", 0) + 1
+        g.sql_time = g.get("sql_time", 0.0) + duration
+
+
+def _start_request() -> None:
+    g.request_started = time.perf_counter()
+
+
+def _end_request(response):
+    if request.blueprint not in current_app.config["METRICS_BLUEPRINTS"]:
+        return response
+
+    endpoint = request.endpoint or "unknown"
+    started = g.get("request_started", time.perf_counter())
+    REQUEST_LATENCY.observe(
+        time.perf_counter() - started,
+        endpoint=endpoint,
+        method=request.method,
+    )
+    REQUESTS.inc(
+        endpoint=endpoint,
+        method=request.method,
+        status=str(response.status_code),
+    )
+    SQL_STATEMENTS.observe(g.get("sql_count", 0), endpoint=endpoint)
+    SQL_REQUEST_TIME.observe(g.get("sql_time", 0.0), endpoint=endpoint)
+    return response
+
+
+def render_metrics() -> str:
+    """
+    :return: All metrics in the Prometheus text format.
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def scrape_allowed() -> bool:
+    """
+    :return: True if the request has the metrics token, or is local and
+        local scrapes are allowed.
+    """
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        expected = f"Bearer {token}"
+        given = request.headers.get("Authorization", "")
+        if hmac.compare_digest(given.encode(), expected.encode()):
+            return True
+    # behind a reverse proxy on the same host every request is local
+    return (
+        current_app.config["METRICS_ALLOW_LOCAL"]
+        and request.remote_addr in LOCAL_ADDRESSES
+    )
+
+
+@bp.route("/metrics")
+def metrics() -> Response:
+    if not scrape_allowed():
+        abort(403)
+    return Response(render_metrics(), content_type=CONTENT_TYPE)
@@ -0,0 +1,157 @@
+"""
+Background lookup of new movies.
+
+`blog.create` only queues a `MovieJob` and returns. A pool of
+`MOVIE_JOB_WORKERS` threads asks OMDB for the movie, stores it and adds it to
+the user's library, so a slow OMDB ties up a job worker instead of a request
+worker. The index page lists unfinished and failed jobs, and
+`/api/v1/jobs/<id>` reports the status of one job.
+
+Jobs live in the `movie_job` table, so pending jobs survive a restart and are
+resumed at startup. Every job is claimed with a conditional UPDATE, so only
+one worker runs it even with several app processes. With
+`MOVIE_JOB_WORKERS = 0` jobs run inline in the request, like before.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from requests import RequestException
+from sqlalchemy.exc import IntegrityError
+
+import movie_web.db_manager as db_manager
+import movie_web.omdb_api as omdb_api
+from movie_web.db_models import Movie, MovieJob, db
+
+logger = logging.getLogger(__name__)
+
+# running jobs older than this lost their worker
+RUNNING_TIMEOUT = timedelta(minutes=10)
+# finished jobs are kept this long for the status endpoint
+FINISHED_RETENTION = timedelta(days=1)
+
+
+class JobRunner:
+    """
+    Runs movie jobs of an app on a thread pool.
+    """
+
+    def __init__(self, app, workers: int = 2) -> None:
+        """
+        :param app: The Flask application object.
+        :param workers: Number of worker threads, 0 runs jobs inline.
+        """
+        self.app = app
+        self.workers = workers
+        self._executor = (
+            ThreadPoolExecutor(workers, "movie-job") if workers else None
+        )
+
+    def submit(self, job_id: int) -> None:
+        """
+        Run a pending job on the pool, or right away without workers.
+
+        :param job_id: The ID of the job.
+        """
+        if self._executor is None:
+            run_job(job_id)
+        else:
+            self._executor.submit(self._run, job_id)
+
+    def _run(self, job_id: int) -> None:
+        with self.app.app_context():
+            try:
+                run_job(job_id)
+            except Exception:
+                logger.exception("Movie job %d failed", job_id)
+                db.session.rollback()
+                job = db_manager.get_movie_job(job_id)
+                if job is not None and job.status == "running":
+                    db_manager.finish_movie_job(job, error="Lookup failed.")
+
+
+def run_job(job_id: int) -> None:
+    """
+    Look up the movie of a pending job and add it to the user's library.
+
+    Needs an application context.
+
+    :param job_id: The ID of the job.
+    """
+    job = db_manager.claim_movie_job(job_id)
+    if job is None:
+        return
+
+    try:
+        omdb_response = omdb_api.get_movie(
+            title=job.title,
+            year=str(job.year) if job.year else None,
+            imdb_id=job.imdb_id,
+        )
+        new_movie = db_manager.serialize_omdb_movie(omdb_response)
+    except (RequestException, ValueError) as e:
+        db_manager.finish_movie_job(job, error=str(e))
+        return
+
+    try:
+        save_movie(job, new_movie)
+    except IntegrityError:
+        if db_manager.get_movie_by_imdb_id(new_movie.imdb_id) is None:
+            raise
+        # another job added the same movie meanwhile, which is found now
+        save_movie(job, new_movie)
+
+
+def save_movie(job: MovieJob, new_movie: Movie) -> None:
+    """
+    Add the looked up movie of a job to the catalog and the user's library
+    and finish the job, in one transaction.
+
+    :param job: The running job.
+    :param new_movie: The unsaved movie from OMDB.
+    """
+    with db_manager.transaction():
+        movie, in_library = db_manager.find_catalog_movie(
+            job.user_id, imdb_id=new_movie.imdb_id
+        )
+        if movie is None:
+            db_manager.add_new_movie_to_user(job.user_id, new_movie)
+            movie = new_movie
+        elif not in_library:
+            db_manager.add_movie_to_user(job.user_id, movie.id)
+        else:
+            db_manager.finish_movie_job(
+                job, movie.id, error=f"{movie.title} is already in your library"
+            )
+            return
+        db_manager.finish_movie_job(job, movie.id)
+
+
+def init_app(app) -> None:
+    """
+    Create the job runner of the app and resume the pending jobs.
+
+    Must run after the database schema exists.
+
+    :param app: The Flask application object.
+    """
+    runner = JobRunner(app, app.config["MOVIE_JOB_WORKERS"])
+    app.extensions["movie_jobs"] = runner
+
+    with app.app_context():
+        now = datetime.now(timezone.utc)
+        db_manager.expire_movie_jobs(
+            running_before=now - RUNNING_TIMEOUT,
+            finished_before=now - FINISHED_RETENTION,
+        )
+        pending_ids = db_manager.get_pending_movie_job_ids()
+    # inline jobs need the app context of a request
+    if runner.workers:
+        for job_id in pending_ids:
+            runner.submit(job_id)
+
+
+def get_runner() -> JobRunner:
+    return current_app.extensions["movie_jobs"]
@@ -1,22 +1,431 @@
 """
 Module for fetching movie data from the OMDB API.
 
-This module loads the API key from environment variables and provides a function
-to request movie information with retry logic for handling HTTP errors.
+This module loads the API key from environment variables and provides a
+long-lived `OmdbClient` which pools connections, retries failed requests,
+limits the request rate across all threads and stops calling OMDB for a while
+after repeated failures. Successful responses are cached in memory and on disk
+(see `omdb_cache`), "Movie not found!" responses (see `omdb_errors`) for
+`OMDB_NEGATIVE_CACHE_TTL` seconds, so repeated lookups of a misspelled title
+do not reach OMDB. Every app builds its client and cache from its `OMDB_*`
+settings.
 
 Usage:
-    Call `request_for_movie(title: str)` with a movie title.
+    Call `init_app(app)` once, then `get_movie(title="The Dark Knight")`.
 """
 
 import os
+import threading
+import time
 
 import requests
 from dotenv import load_dotenv
+from flask import current_app, has_app_context
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from movie_web import metrics
+from movie_web.omdb_cache import DEFAULT_CACHE_PATH, OmdbCache
+from movie_web.omdb_errors import is_not_found
+
 load_dotenv()
 API_KEY = os.getenv("OMDB_API_KEY")
+CACHE_TTL = int(os.getenv("OMDB_CACHE_TTL", 24 * 60 * 60))
+CACHE_SIZE = int(os.getenv("OMDB_CACHE_SIZE", 512))
+CACHE_PATH = os.getenv("OMDB_CACHE_PATH", DEFAULT_CACHE_PATH)
+NEGATIVE_CACHE_TTL = int(os.getenv("OMDB_NEGATIVE_CACHE_TTL", 60 * 60))
+
+OMDB_URL = "http://www.omdbapi.com/"
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class OmdbUnavailableError(requests.RequestException):
+    """
+    Raised when OMDB is not called because it is failing or rate limited.
+    """
+
+    code = 503
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket which allows `rate` requests per second with
+    bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        """
+        Take one token, waiting at most `timeout` seconds for it.
+
+        :param timeout: Maximum number of seconds to wait.
+        :return: True if a token was taken, otherwise False.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens and
+    rejects calls for `reset_timeout` seconds. Afterwards a single trial call
+    is let through; its outcome closes or reopens the breaker.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be made right now.
+
+        :return: True if the call may proceed, otherwise False.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if (
+                self._opened_at is not None
+                or self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+
+
+class OmdbClient:
+    """
+    Client for the OMDB API which is shared by all threads of the app.
+    """
+
+    def __init__(
+        self,
+        api_key: str | None = API_KEY,
+        url: str = OMDB_URL,
+        timeout: float = 5,
+        retries: int = 2,
+        backoff_factor: float = 0.5,
+        pool_size: int = 10,
+        rate_limit: float = 5,
+        burst: int = 10,
+        rate_limit_wait: float = 2,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        response_cache: OmdbCache | None = None,
+    ) -> None:
+        """
+        :param api_key: The OMDB API key.
+        :param url: The OMDB endpoint.
+        :param timeout: Seconds to wait for OMDB to answer a single request.
+        :param retries: Number of retries for timeouts and retryable status codes.
+        :param backoff_factor: Backoff factor between retries in seconds.
+        :param pool_size: Number of keep-alive connections kept open.
+        :param rate_limit: Requests per second allowed across all threads.
+        :param burst: Number of requests allowed in a burst.
+        :param rate_limit_wait: Seconds a caller waits for the rate limit.
+        :param failure_threshold: Consecutive failures which open the breaker.
+        :param reset_timeout: Seconds the breaker stays open.
+        :param response_cache: Cache for OMDB responses, or None.
+        """
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.rate_limit_wait = rate_limit_wait
+        self.cache = response_cache
+        self.bucket = TokenBucket(rate_limit, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        # Configure retries with exponential backoff, capped so a degraded
+        # OMDB cannot block a worker for long
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            backoff_max=timeout,
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=["GET"],
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry, pool_connections=1, pool_maxsize=pool_size
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get_movie(
+        self,
+        title: str | None = None,
+        year: str | None = None,
+        imdb_id: str | None = None,
+        rate_limit_wait: float | None = None,
+        bypass_cache: bool = False,
+    ) -> dict:
+        """
+        Request a movie by title and/or year or by IMDb ID.
+
+        Cached responses are returned without a request unless `bypass_cache`
+        is set; fresh responses are cached either way.
+
+        :param title: The movie title to search for. Defaults to None.
+        :param year: The movie year to search for. Defaults to None.
+        :param imdb_id: The IMDb ID to search for. Defaults to None.
+        :param rate_limit_wait: Seconds to wait for the rate limit. Defaults to
+            the wait time of the client.
+        :param bypass_cache: Always request OMDB. Defaults to False.
+        :return: The JSON response from the server containing movie information.
+        :raises OmdbUnavailableError: If the breaker is open or the rate limit is hit.
+        :raises HTTPError: If an HTTP error occurs and retries are exhausted.
+        :raises Timeout: If the request times out and retries are exhausted.
+        """
+        params = set_params(title, year, imdb_id, api_key=self.api_key)
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(params)
+            cached_response = None if bypass_cache else self.cache.get(cache_key)
+            if cached_response is not None:
+                metrics.OMDB_CACHE.inc(
+                    result="negative_hit"
+                    if is_not_found(cached_response)
+                    else "hit"
+                )
+                return cached_response
+            metrics.OMDB_CACHE.inc(result="bypass" if bypass_cache else "miss")
+
+        movie = self.request(params, rate_limit_wait)
+
+        if cache_key is not None:
+            self.store_in_cache(cache_key, movie)
+        return movie
+
+    def is_known_missing(
+        self,
+        title: str | None = None,
+        year: str | None = None,
+        imdb_id: str | None = None,
+    ) -> bool:
+        """
+        Check whether OMDB recently answered this request with "Movie not
+        found!", without sending a request.
+
+        :param title: The movie title to search for. Defaults to None.
+        :param year: The movie year to search for. Defaults to None.
+        :param imdb_id: The IMDb ID to search for. Defaults to None.
+        :return: True if a cached response says the movie does not exist.
+        """
+        if self.cache is None:
+            return False
+        try:
+            params = set_params(title, year, imdb_id, api_key=self.api_key)
+        except ValueError:
+            # reported by the actual lookup
+            return False
+        cached_response = self.cache.peek(self.cache.make_key(params))
+        return cached_response is not None and is_not_found(cached_response)
+
+    def request(
+        self, params: dict[str, str], rate_limit_wait: float | None = None
+    ) -> dict:
+        """
+        Send a rate-limited request guarded by the circuit breaker.
+
+        :param params: The query parameters created by `set_params`.
+        :param rate_limit_wait: Seconds to wait for the rate limit.
+        :return: The decoded JSON response.
+        :raises OmdbUnavailableError: If the breaker is open or the rate limit is hit.
+        """
+        # take the token first, a trial call of the breaker must not be
+        # rejected by the rate limit
+        if rate_limit_wait is None:
+            rate_limit_wait = self.rate_limit_wait
+        if not self.bucket.acquire(rate_limit_wait):
+            metrics.OMDB_REQUESTS.inc(outcome="rate_limited")
+            raise OmdbUnavailableError("Too many OMDB requests, try again later.")
+        if not self.breaker.allow():
+            metrics.OMDB_REQUESTS.inc(outcome="circuit_open")
+            raise OmdbUnavailableError("OMDB is unavailable, try again later.")
+
+        started = time.perf_counter()
+        try:
+            response = self.session.get(
+                self.url, params=params, timeout=self.timeout
+            )
+            record_retries(response)
+            response.raise_for_status()  # Raise an error for bad HTTP responses
+            movie = response.json()
+        except requests.HTTPError as e:
+            status_code = getattr(e.response, "status_code", 0)
+            metrics.OMDB_REQUESTS.inc(outcome=f"http_{status_code}")
+            if e.response is not None and e.response.status_code < 500:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            raise
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.RetryError,
+        ) as e:
+            metrics.OMDB_REQUESTS.inc(outcome=error_outcome(e))
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            # e.g. a broken body, which must still end a trial call
+            metrics.OMDB_REQUESTS.inc(outcome="error")
+            self.breaker.record_failure()
+            raise
+        finally:
+            metrics.OMDB_LATENCY.observe(time.perf_counter() - started)
+
+        metrics.OMDB_REQUESTS.inc(outcome="ok")
+        self.breaker.record_success()
+        return movie
+
+    def store_in_cache(self, cache_key: str, movie: dict) -> None:
+        """
+        Cache a successful OMDB response under its request key and its IMDb ID.
+
+        Caching under the IMDb ID as well lets a later refresh of a movie that
+        was added by title skip the request. "Movie not found!" responses are
+        cached under the request key only, with the shorter negative TTL.
+
+        :param cache_key: The cache key of the original request.
+        :param movie: The decoded OMDB response.
+        """
+        if self.cache is None:
+            return
+        if is_not_found(movie):
+            self.cache.set(cache_key, movie)
+            return
+        if movie.get("Response") != "True":
+            return
+
+        self.cache.set(cache_key, movie)
+        imdb_id = movie.get("imdbID")
+        if imdb_id:
+            self.cache.set(self.cache.make_key({"i": imdb_id}), movie)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def record_retries(response: requests.Response) -> None:
+    # urllib3 keeps the retry history on the raw response
+    retries = getattr(response.raw, "retries", None)
+    if retries is not None and retries.history:
+        metrics.OMDB_RETRIES.inc(len(retries.history))
+
+
+def error_outcome(error: requests.RequestException) -> str:
+    if isinstance(error, requests.exceptions.RetryError):
+        return "retries_exhausted"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    return "connection_error"
+
+
+def init_app(app) -> None:
+    """
+    Create the OMDB client of the app and its response cache from the
+    configuration.
+
+    :param app: The Flask application object.
+    """
+    response_cache = OmdbCache(
+        app.config["OMDB_CACHE_PATH"],
+        ttl=app.config["OMDB_CACHE_TTL"],
+        max_entries=app.config["OMDB_CACHE_SIZE"],
+        negative_ttl=app.config["OMDB_NEGATIVE_CACHE_TTL"],
+    )
+    app.extensions["omdb_client"] = OmdbClient(
+        api_key=app.config["OMDB_API_KEY"],
+        url=app.config["OMDB_BASE_URL"],
+        timeout=app.config["OMDB_TIMEOUT"],
+        retries=app.config["OMDB_RETRIES"],
+        pool_size=app.config["OMDB_POOL_SIZE"],
+        rate_limit=app.config["OMDB_RATE_LIMIT"],
+        burst=app.config["OMDB_BURST"],
+        failure_threshold=app.config["OMDB_FAILURE_THRESHOLD"],
+        reset_timeout=app.config["OMDB_RESET_TIMEOUT"],
+        response_cache=response_cache,
+    )
+
+
+def get_client() -> OmdbClient:
+    """
+    Return the client of the current app, or a default client outside of an
+    application context.
+
+    :return: The OMDB client.
+    """
+    global _default_client
+
+    if has_app_context() and "omdb_client" in current_app.extensions:
+        return current_app.extensions["omdb_client"]
+
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = OmdbClient(
+                response_cache=OmdbCache(
+                    CACHE_PATH,
+                    ttl=CACHE_TTL,
+                    max_entries=CACHE_SIZE,
+                    negative_ttl=NEGATIVE_CACHE_TTL,
+                )
+            )
+        return _default_client
 
 
 def get_movie(
@@ -25,50 +434,41 @@ def get_movie(
     imdb_id: str | None = None,
 ) -> dict:
     """
-    Send a GET request with a movie title and/or year or an imdb-ID to www.omdbapi.com with authorization
-    and retry logic.
+    Send a GET request with a movie title and/or year or an imdb-ID to www.omdbapi.com
+    using the shared OMDB client.
 
     :param title: The movie title to search for. Defaults to None.
     :param year: The movie year to search for. Defaults to None.
     :param imdb_id: The IMDb ID to search for. Defaults to None.
     :return: The JSON response from the server containing movie information.
-    :raises HTTPError: If an HTTP error occurs and retries are exhausted.
-    :raises Timeout: If the request times out and retries are exhausted.
-    """
-
-    url = "http://www.omdbapi.com/?"
-    headers = {"Content-Type": "application/json"}
-    params = set_params(title, year, imdb_id)
-    timeout = 5
-
-    # Configure retries with exponential backoff
-    retries = Retry(
-        total=3,  # Total number of retries
-        backoff_factor=1,  # Wait time between retries: 1 second, 2 seconds, 4 seconds
-        status_forcelist=[
-            429,
-            500,
-            502,
-            503,
-            504,
-        ],  # Retry on specific status codes
-    )
+    """
+    return get_client().get_movie(title=title, year=year, imdb_id=imdb_id)
 
-    # Set up the HTTPAdapter with retry configuration
-    adapter = HTTPAdapter(max_retries=retries)
 
-    # Use requests.Session() to apply retries
-    with requests.Session() as session:
-        session.mount("https://", adapter)
-        response = session.get(
-            url, headers=headers, params=params, timeout=timeout
-        )
-        response.raise_for_status()  # Raise an error for bad HTTP responses
-        return response.json()
+def is_known_missing(
+    title: str | None = None,
+    year: str | None = None,
+    imdb_id: str | None = None,
+) -> bool:
+    """
+    Check with the shared OMDB client whether the movie is known to be
+    missing on OMDB.
+
+    :param title: The movie title to search for. Defaults to None.
+    :param year: The movie year to search for. Defaults to None.
+    :param imdb_id: The IMDb ID to search for. Defaults to None.
+    :return: True if a cached response says the movie does not exist.
+    """
+    return get_client().is_known_missing(
+        title=title, year=year, imdb_id=imdb_id
+    )
 
 
 def set_params(
-    title: str | None, year: str | None, imdb_id: str | None
+    title: str | None,
+    year: str | None,
+    imdb_id: str | None,
+    api_key: str | None = None,
 ) -> dict[str, str]:
     """
     Sets the parameters for the OMDB API request.
@@ -76,6 +476,7 @@ def set_params(
     :param title: The movie title to include in the request.
     :param year: The movie year to include in the request.
     :param imdb_id: The IMDb ID to include in the request.
+    :param api_key: The API key to use. Defaults to `OMDB_API_KEY`.
     :return: A dictionary of query parameters for the API request.
     :raises ValueError: If neither title nor imdb_id is provided.
     """
@@ -90,11 +491,12 @@ def set_params(
     if imdb_id:
         params = {"i": imdb_id}
 
-    if not API_KEY:
+    api_key = api_key or API_KEY
+    if not api_key:
         raise ValueError("API key is missing.")
 
     params.update({
-        "apikey": API_KEY,
+        "apikey": api_key,
         "plot": "full",  # "full" or "short" movie description
     })
 
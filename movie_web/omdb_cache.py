@@ -0,0 +1,237 @@
+"""
+Two-tier cache for OMDB API responses.
+
+The first tier is an in-process LRU map, the second tier is a small SQLite
+database next to the application database, so cached responses survive
+restarts and are shared between worker processes. Error responses, such as
+"Movie not found!", expire after the shorter `negative_ttl`, so a title added
+to OMDB later is found again soon.
+
+Usage:
+    cache = OmdbCache(path, ttl=86400, negative_ttl=3600)
+    key = cache.make_key(params)
+    response = cache.get(key)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(ROOT_PATH, "data", "omdb_cache.sqlite")
+
+# request parameters which do not identify a movie
+IGNORED_PARAMS = ("apikey", "plot")
+
+
+class OmdbCache:
+    """
+    Thread-safe LRU cache with a persistent SQLite tier and a TTL.
+    """
+
+    def __init__(
+        self,
+        path: str | None = DEFAULT_CACHE_PATH,
+        ttl: int = 86400,
+        max_entries: int = 512,
+        negative_ttl: int = 3600,
+    ) -> None:
+        """
+        :param path: Path of the SQLite file, or None to disable the disk tier.
+        :param ttl: Seconds until a cached response expires.
+        :param max_entries: Maximum number of responses kept in memory.
+        :param negative_ttl: Seconds until a cached error response expires.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @staticmethod
+    def make_key(params: dict[str, str]) -> str:
+        """
+        Build a cache key from OMDB request parameters.
+
+        Titles are case-folded and whitespace is collapsed, so "the dark  Knight"
+        and "The Dark Knight" share one entry.
+
+        :param params: The query parameters created by `omdb_api.set_params`.
+        :return: A normalized cache key.
+        """
+        parts = []
+        for name in sorted(params):
+            if name in IGNORED_PARAMS:
+                continue
+            value = " ".join(str(params[name]).split()).casefold()
+            parts.append(f"{name}={value}")
+        return "&".join(parts)
+
+    def get(self, key: str) -> dict | None:
+        """
+        Look up a cached response, first in memory and then on disk.
+
+        :param key: The cache key.
+        :return: The cached response or None if missing or expired.
+        """
+        with self._lock:
+            response, tier = self._find(key)
+            if tier == "memory":
+                self.memory_hits += 1
+            elif tier == "disk":
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+            return response
+
+    def peek(self, key: str) -> dict | None:
+        """
+        Like `get`, but without counting a hit or miss, for checks before the
+        actual lookup.
+
+        :param key: The cache key.
+        :return: The cached response or None if missing or expired.
+        """
+        with self._lock:
+            return self._find(key)[0]
+
+    def set(self, key: str, response: dict) -> None:
+        """
+        Store a response in both cache tiers.
+
+        :param key: The cache key.
+        :param response: The decoded OMDB response.
+        """
+        fetched = time.time()
+        with self._lock:
+            self._remember(key, fetched, response)
+            connection = self._connect()
+            if connection is not None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO omdb_response (key, payload, fetched) "
+                    "VALUES (?, ?, ?)",
+                    (key, json.dumps(response), fetched),
+                )
+                connection.commit()
+
+    def ttl_of(self, response: dict) -> int:
+        """
+        :param response: A cached OMDB response.
+        :return: The seconds the response stays cached.
+        """
+        if response.get("Response") == "False":
+            return self.negative_ttl
+        return self.ttl
+
+    def purge_expired(self) -> int:
+        """
+        Remove expired responses from the disk tier.
+
+        :return: The number of removed responses.
+        """
+        with self._lock:
+            connection = self._connect()
+            if connection is None:
+                return 0
+            now = time.time()
+            cursor = connection.execute(
+                "DELETE FROM omdb_response WHERE fetched < ? OR (fetched < ? "
+                "AND json_extract(payload, '$.Response') = 'False')",
+                (now - self.ttl, now - self.negative_ttl),
+            )
+            connection.commit()
+            return cursor.rowcount
+
+    def clear(self) -> None:
+        """
+        Remove every cached response and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            connection = self._connect()
+            if connection is not None:
+                connection.execute("DELETE FROM omdb_response")
+                connection.commit()
+            self.memory_hits = self.disk_hits = self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Return the hit and miss counters of the cache.
+
+        :return: A dictionary with memory hits, disk hits, misses and size.
+        """
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }
+
+    def _find(self, key: str) -> tuple[dict | None, str | None]:
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            fetched, response = entry
+            if now - fetched < self.ttl_of(response):
+                self._memory.move_to_end(key)
+                return response, "memory"
+            del self._memory[key]
+
+        row = self._read_disk(key)
+        if row is not None:
+            fetched, response = row
+            if now - fetched < self.ttl_of(response):
+                self._remember(key, fetched, response)
+                return response, "disk"
+            self._delete_disk(key)
+        return None, None
+
+    def _remember(self, key: str, fetched: float, response: dict) -> None:
+        self._memory[key] = (fetched, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection | None:
+        if self.path is None:
+            return None
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, timeout=5, check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS omdb_response ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, fetched REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _read_disk(self, key: str) -> tuple[float, dict] | None:
+        connection = self._connect()
+        if connection is None:
+            return None
+        row = connection.execute(
+            "SELECT fetched, payload FROM omdb_response WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _delete_disk(self, key: str) -> None:
+        connection = self._connect()
+        if connection is not None:
+            connection.execute(
+                "DELETE FROM omdb_response WHERE key = ?", (key,)
+            )
+            connection.commit()
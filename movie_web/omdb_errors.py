@@ -0,0 +1,30 @@
+"""
+OMDB answers which mean a movie does not exist.
+
+Shared by the OMDB client, which caches these answers, and `db_manager`,
+which refuses to turn them into movies.
+
+Usage:
+    if is_not_found(omdb_response):
+        raise MovieNotFoundError(omdb_response["Error"])
+"""
+
+# errors of OMDB which mean the movie does not exist
+NOT_FOUND_ERRORS = ("Movie not found!", "Incorrect IMDb ID.")
+
+
+class MovieNotFoundError(ValueError):
+    """
+    Raised when OMDB does not know the requested movie.
+    """
+
+
+def is_not_found(response: dict) -> bool:
+    """
+    :param response: A decoded OMDB response.
+    :return: True if OMDB answered that the movie does not exist.
+    """
+    return (
+        response.get("Response") == "False"
+        and response.get("Error") in NOT_FOUND_ERRORS
+    )
@@ -0,0 +1,186 @@
+"""
+Cache for rendered pages with ETags and conditional GET.
+
+Views decorated with `cached_page` are cached per endpoint, view arguments,
+user and data version. The data version of a movie is bumped by database
+triggers whenever the movie or one of its reviews changes, so an update
+invalidates exactly the pages of that movie. Outdated entries are never read
+again and drop out of the LRU.
+
+Every cached response gets a strong ETag derived from its key, so a browser
+which sends a matching `If-None-Match` header gets a 304 without rendering.
+Requests with pending flash messages bypass the cache, because the messages
+are part of the page.
+
+Usage:
+    @bp.route("/movie/<int:movie_id>")
+    @login_required
+    @cached_page(db_manager.get_movie_version)
+    def movie_details(movie_id): ...
+"""
+
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from flask import current_app, g, make_response, request, session
+
+
+class PageCache:
+    """
+    Thread-safe LRU map of rendered page bodies.
+    """
+
+    def __init__(self, max_entries: int = 1024) -> None:
+        """
+        :param max_entries: Maximum number of pages kept in memory, 0 disables
+            the cache.
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._pages: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> bytes | None:
+        """
+        Look up a cached page body.
+
+        :param key: The cache key.
+        :return: The page body or None if it is not cached.
+        """
+        with self._lock:
+            body = self._pages.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def set(self, key: Hashable, body: bytes) -> None:
+        """
+        Store a page body and evict the least recently used pages.
+
+        :param key: The cache key.
+        :param body: The rendered page.
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._pages[key] = body
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._pages),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def init_app(app) -> None:
+    """
+    Create the page cache of the app from the `PAGE_CACHE_SIZE` setting.
+
+    :param app: The Flask application object.
+    """
+    app.extensions["page_cache"] = PageCache(app.config["PAGE_CACHE_SIZE"])
+    app.extensions["page_cache_salt"] = template_digest(app)
+
+
+def template_digest(app) -> str:
+    """
+    Hash the templates of the app, so ETags change when a deployment changes
+    the markup.
+
+    :param app: The Flask application object.
+    :return: A hex digest of all template files.
+    """
+    digest = hashlib.sha256()
+    templates = os.path.join(app.root_path, app.template_folder or "templates")
+    for directory, _, files in sorted(os.walk(templates)):
+        for name in sorted(files):
+            path = os.path.join(directory, name)
+            digest.update(os.path.relpath(path, templates).encode())
+            with open(path, "rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+def get_cache() -> PageCache:
+    return current_app.extensions["page_cache"]
+
+
+def cached_page(get_version: Callable[..., int | None]) -> Callable:
+    """
+    Decorator which caches the rendered page of a GET view and answers
+    conditional requests.
+
+    Must be applied below `login_required`, so `g.user` is known.
+
+    :param get_version: Called with the view arguments, returns the data
+        version of the page, or None to skip the cache, e.g. for a 404.
+    :return: The decorator.
+    """
+
+    def decorator(view: Callable) -> Callable:
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            if request.method != "GET" or "_flashes" in session:
+                return view(**kwargs)
+
+            version = get_version(**kwargs)
+            if version is None:
+                return view(**kwargs)
+
+            user_id = g.user.id if g.user is not None else None
+            key = (request.endpoint, tuple(sorted(kwargs.items())), user_id, version)
+            etag = make_etag(key)
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                cache = get_cache()
+                body = cache.get(key)
+                if body is None:
+                    response = make_response(view(**kwargs))
+                    if response.status_code != 200:
+                        return response
+                    cache.set(key, response.get_data())
+                else:
+                    response = current_app.response_class(
+                        body, mimetype="text/html"
+                    )
+
+            response.set_etag(etag)
+            # browsers revalidate every time, the 304 keeps that cheap
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+def make_etag(key: Hashable) -> str:
+    """
+    Build a strong ETag from a page cache key and the template digest.
+
+    :param key: The cache key.
+    :return: The ETag value without quotes.
+    """
+    salt = current_app.extensions["page_cache_salt"]
+    return hashlib.sha256(f"{salt}:{key!r}".encode()).hexdigest()[:32]
@@ -0,0 +1,176 @@
+"""
+Password hashing off the request thread.
+
+Hashing and verifying passwords is deliberately slow. Both run in a process
+pool, so a burst of logins does not hold the GIL of the worker serving other
+requests. The number of waiting jobs is bounded; when the pool is saturated
+`PasswordHasherBusy` is raised instead of queueing more work, and also when
+a job times out or a hashing process dies. The processes are started by a
+fork server, so scripts creating the app need an `if __name__ == "__main__"`
+guard.
+
+The hash method comes from `PASSWORD_HASH_METHOD`, e.g. "scrypt" or
+"pbkdf2:sha256:600000". Hashes created with other parameters are upgraded on
+the next successful login, see `needs_rehash`.
+
+Usage:
+    Call `init_app(app)` once, then `hash_password(password)` and
+    `verify_password(password_hash, password)`.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# seconds a hashing job may take before the request gives up
+HASH_TIMEOUT = 10
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many passwords are hashed at the same time.
+    """
+
+
+class PasswordHasher:
+    """
+    Hash and verify passwords in a bounded process pool.
+    """
+
+    def __init__(
+        self, method: str = "scrypt", workers: int = 2, max_pending: int = 16
+    ) -> None:
+        """
+        :param method: The werkzeug hash method with its parameters.
+        :param workers: Number of hashing processes, 0 hashes on the calling
+            thread.
+        :param max_pending: Maximum number of running and waiting jobs.
+        """
+        self.method = method
+        self.workers = workers
+        # the normalized method of new hashes, e.g. "scrypt:32768:8:1"
+        self.method_prefix = generate_password_hash("", method).split("$")[0]
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor: ProcessPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+
+    def hash(self, password: str) -> str:
+        """
+        :param password: The plain password.
+        :return: The password hash.
+        :raises PasswordHasherBusy: If the pool is saturated or the job timed
+            out.
+        """
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """
+        :param password_hash: The stored password hash.
+        :param password: The plain password.
+        :return: True if the password matches.
+        :raises PasswordHasherBusy: If the pool is saturated or the job timed
+            out.
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Check whether a hash was created with other parameters than the
+        configured method.
+
+        :param password_hash: The stored password hash.
+        :return: True if the hash should be replaced.
+        """
+        return password_hash.split("$")[0] != self.method_prefix
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many password checks, try again.")
+        executor = self._get_executor()
+        try:
+            future: Future = executor.submit(function, *args)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self._discard_executor(executor)
+                raise PasswordHasherBusy(
+                    "The password check failed, try again."
+                ) from None
+            raise
+        # the slot is held until the job is done, also after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=HASH_TIMEOUT)
+        except TimeoutError:
+            raise PasswordHasherBusy(
+                "The password check took too long, try again."
+            ) from None
+        except BrokenProcessPool:
+            # a hashing process died, e.g. killed for its memory
+            self._discard_executor(executor)
+            raise PasswordHasherBusy(
+                "The password check failed, try again."
+            ) from None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # created on first use, so forking app servers start it per worker.
+        # The processes come from a fork server, not from a fork of this
+        # threaded process with its open pools and locks.
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._executor
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        # the next job starts a new pool
+        with self._executor_lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def init_app(app) -> None:
+    """
+    Create the password hasher of the app from its configuration.
+
+    :param app: The Flask application object.
+    """
+    app.extensions["password_hasher"] = PasswordHasher(
+        method=app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_pending=app.config["PASSWORD_HASH_MAX_PENDING"],
+    )
+
+
+def get_hasher() -> PasswordHasher:
+    return current_app.extensions["password_hasher"]
+
+
+def hash_password(password: str) -> str:
+    return get_hasher().hash(password)
+
+
+def verify_password(password_hash: str, password: str) -> bool:
+    return get_hasher().verify(password_hash, password)
+
+
+def needs_rehash(password_hash: str) -> bool:
+    return get_hasher().needs_rehash(password_hash)
@@ -0,0 +1,330 @@
+"""
+Local copies of movie posters.
+
+Posters are downloaded once in the background and stored under
+`POSTER_DIR` with content-hashed file names, so they can be served with
+immutable cache headers. Every poster has a small thumbnail for the library
+and a full variant for the movie page. The variants are requested from the
+image host by rewriting the size in Amazon poster URLs; other URLs get the
+original image for both variants.
+
+Pages call `poster_url(movie, "thumb")`. If the poster is not stored yet it
+schedules the download and returns the remote URL until the download is done.
+
+Only https URLs on the `POSTER_HOSTS` of OMDB are downloaded, without
+following redirects, and only image responses up to `MAX_POSTER_SIZE` bytes
+are stored. Other poster links are neither fetched nor shown, pages show a
+placeholder instead.
+
+The fetcher which downloads an URL is pluggable through `POSTER_FETCHER`. To
+test against a local stand-in server, allow its origin in `POSTER_HOSTS` and
+point the poster links there:
+    create_app({"POSTER_HOSTS": ("http://127.0.0.1:8002",)})
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from urllib.parse import urlsplit
+
+import requests
+from flask import Blueprint, current_app, send_from_directory, url_for
+from requests.adapters import HTTPAdapter
+
+import movie_web.db_manager as db_manager
+from movie_web.db_models import Movie
+
+logger = logging.getLogger(__name__)
+
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_POSTER_DIR = os.path.join(ROOT_PATH, "data", "posters")
+
+# variant name: image width in pixels
+VARIANTS = {"thumb": 150, "full": 500}
+
+# size part of Amazon image URLs, e.g. "._V1_SX300.jpg"
+AMAZON_SIZE_PATTERN = re.compile(r"\._V1_[^/]*?(\.\w+)$")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# files never change under their name
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# seconds before a failed poster is downloaded again
+RETRY_FAILED_AFTER = 60 * 60
+
+# image hosts of the OMDB posters
+DEFAULT_POSTER_HOSTS = ("m.media-amazon.com",)
+MAX_POSTER_SIZE = 5 * 1024 * 1024
+# static file shown for movies without a poster
+PLACEHOLDER = "poster-placeholder.svg"
+
+bp = Blueprint("posters", __name__, url_prefix="/posters")
+
+
+class InvalidPosterError(ValueError):
+    """
+    Raised when a poster URL or response is not a poster of an allowed host.
+    """
+
+
+class HttpFetcher:
+    """
+    Download images over a pooled HTTP session.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10,
+        pool_size: int = 4,
+        max_size: int = MAX_POSTER_SIZE,
+    ) -> None:
+        self.timeout = timeout
+        self.max_size = max_size
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def __call__(self, url: str) -> bytes:
+        """
+        :param url: The image URL.
+        :return: The image data.
+        :raises requests.RequestException: If the download failed.
+        :raises InvalidPosterError: If the response is no image or too big.
+        """
+        # a redirect could lead to any host
+        with self.session.get(
+            url, timeout=self.timeout, stream=True, allow_redirects=False
+        ) as response:
+            response.raise_for_status()
+            content_type = response.headers.get("Content-Type", "")
+            if response.status_code != 200 or not content_type.startswith(
+                "image/"
+            ):
+                raise InvalidPosterError(f"{url} is not an image")
+
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_size:
+                    raise InvalidPosterError(f"{url} is too big")
+        return bytes(data)
+
+
+class PosterStore:
+    """
+    Content-addressed poster files with a background download queue.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_POSTER_DIR,
+        fetcher: Callable[[str], bytes] | None = None,
+        workers: int = 2,
+        hosts: tuple[str, ...] = DEFAULT_POSTER_HOSTS,
+    ) -> None:
+        """
+        :param directory: Directory of the poster files.
+        :param fetcher: Downloads an URL and returns its data. Defaults to an
+            `HttpFetcher`.
+        :param workers: Number of background download threads.
+        :param hosts: The only hosts posters are downloaded from over https,
+            or origins like "http://127.0.0.1:8002" for a local stand-in.
+        """
+        self.directory = directory
+        self.hosts = hosts
+        self._origins = {origin(host) for host in hosts}
+        self.fetcher = fetcher or HttpFetcher()
+        self._executor = ThreadPoolExecutor(workers, "poster-download")
+        self._lock = threading.Lock()
+        self._scheduled: set[int] = set()
+        self._failed: dict[str, float] = {}
+
+    def is_allowed(self, poster_link: str | None) -> bool:
+        """
+        :param poster_link: A poster URL.
+        :return: True if it is an https URL on one of the poster hosts, or
+            an URL on one of the configured origins.
+        """
+        if not poster_link:
+            return False
+        try:
+            parts = urlsplit(poster_link)
+            link_origin = origin(poster_link)
+        except ValueError:
+            return False
+        return parts.username is None and link_origin in self._origins
+
+    @staticmethod
+    def variant_url(poster_link: str, width: int) -> str:
+        """
+        Rewrite an Amazon poster URL to the given width.
+
+        :param poster_link: The poster URL from OMDB.
+        :param width: The image width in pixels.
+        :return: The URL of the variant, or the original URL if the host does
+            not support resizing.
+        """
+        return AMAZON_SIZE_PATTERN.sub(rf"._V1_SX{width}\1", poster_link)
+
+    def download(self, poster_link: str) -> dict[str, str]:
+        """
+        Download and store all variants of a poster.
+
+        :param poster_link: The poster URL from OMDB.
+        :return: The file name of every variant.
+        :raises requests.RequestException: If a download failed.
+        :raises InvalidPosterError: If the poster is not on a poster host.
+        """
+        if not self.is_allowed(poster_link):
+            raise InvalidPosterError(f"{poster_link} is not a poster URL")
+
+        names = {}
+        downloaded: dict[str, str] = {}
+        for variant, width in VARIANTS.items():
+            url = self.variant_url(poster_link, width)
+            if url not in downloaded:
+                downloaded[url] = self.save(self.fetcher(url), url)
+            names[variant] = downloaded[url]
+        return names
+
+    def save(self, data: bytes, url: str) -> str:
+        """
+        Write image data under its content hash.
+
+        :param data: The image data.
+        :param url: The image URL, for the file extension.
+        :return: The file name.
+        """
+        extension = os.path.splitext(url.split("?")[0])[1].lower()
+        if extension not in IMAGE_EXTENSIONS:
+            extension = ".jpg"
+        name = hashlib.sha256(data).hexdigest()[:32] + extension
+        path = os.path.join(self.directory, name)
+
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        return name
+
+    def schedule(self, app, movie_id: int, poster_link: str) -> None:
+        """
+        Download a poster in the background and store the file names on the
+        movie. Movies which are already queued are skipped.
+
+        :param app: The Flask application object.
+        :param movie_id: The ID of the movie.
+        :param poster_link: The poster URL from OMDB.
+        """
+        with self._lock:
+            failed = self._failed.get(poster_link)
+            if movie_id in self._scheduled or (
+                failed and time.monotonic() - failed < RETRY_FAILED_AFTER
+            ):
+                return
+            self._scheduled.add(movie_id)
+        self._executor.submit(self._fetch, app, movie_id, poster_link)
+
+    def _fetch(self, app, movie_id: int, poster_link: str) -> None:
+        try:
+            names = self.download(poster_link)
+            with app.app_context():
+                db_manager.set_movie_posters(movie_id, poster_link, **names)
+        except Exception as e:
+            logger.warning("Could not store poster %s: %s", poster_link, e)
+            with self._lock:
+                self._failed[poster_link] = time.monotonic()
+        finally:
+            with self._lock:
+                self._scheduled.discard(movie_id)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init_app(app) -> None:
+    """
+    Create the poster store of the app and register the poster route and
+    template helper.
+
+    :param app: The Flask application object.
+    """
+    app.extensions["poster_store"] = PosterStore(
+        directory=app.config["POSTER_DIR"],
+        fetcher=app.config["POSTER_FETCHER"],
+        workers=app.config["POSTER_WORKERS"],
+        hosts=tuple(app.config["POSTER_HOSTS"]),
+    )
+    app.register_blueprint(bp)
+    app.add_template_global(poster_url)
+
+
+def get_store() -> PosterStore:
+    return current_app.extensions["poster_store"]
+
+
+def poster_url(movie: Movie, variant: str = "full") -> str:
+    """
+    Return the URL of a poster variant, scheduling the download if the
+    poster is not stored yet.
+
+    :param movie: The movie, with the poster columns loaded.
+    :param variant: "thumb" or "full".
+    :return: The local URL, the remote poster URL while it is downloaded, or
+        the placeholder for movies without a poster on a poster host.
+    """
+    name = movie.poster_thumb if variant == "thumb" else movie.poster_full
+    if name:
+        return url_for("posters.poster", name=name)
+
+    store = get_store()
+    if not store.is_allowed(movie.poster_link):
+        return url_for("static", filename=PLACEHOLDER)
+    store.schedule(
+        current_app._get_current_object(),  # type: ignore
+        movie.id,
+        movie.poster_link,
+    )
+    return movie.poster_link
+
+
+def origin(url: str) -> tuple[str, str | None, int | None]:
+    """
+    :param url: A poster URL, or a bare host name for https.
+    :return: The scheme, host name and port of the URL.
+    :raises ValueError: If the port is invalid.
+    """
+    if "://" not in url:
+        url = f"https://{url}"
+    parts = urlsplit(url)
+    default_port = {"http": 80, "https": 443}.get(parts.scheme)
+    return parts.scheme, parts.hostname, parts.port or default_port
+
+
+def is_allowed_poster_link(poster_link: str | None) -> bool:
+    return get_store().is_allowed(poster_link)
+
+
+@bp.route("/<name>")
+def poster(name: str):
+    """
+    Serve a stored poster. The content-hashed name never changes its content,
+    so browsers may cache it forever.
+
+    :param name: The file name of the poster.
+    :return: The image response.
+    """
+    response = send_from_directory(
+        current_app.config["POSTER_DIR"], name, max_age=IMMUTABLE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,136 @@
+"""
+SQL statement budgets for views.
+
+Views declare the maximum number of SQL statements a request may issue with
+the `query_budget` decorator. Statements are counted per request through
+SQLAlchemy engine events. When `QUERY_BUDGET_ENFORCE` is set, e.g. in tests, a
+request which exceeds its budget raises `QueryBudgetExceeded`; otherwise a
+warning is logged.
+
+Usage in tests:
+    with count_queries(app) as counter:
+        client.get("/")
+    assert counter.count <= 2
+
+    with assert_max_queries(app, 3):
+        client.get("/movie/1")
+"""
+
+import contextlib
+import logging
+from typing import Callable, Iterator
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from movie_web.db_models import db
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """
+    Raised when a request issues more SQL statements than its view allows.
+    """
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.count = 0
+        self.statements: list[str] = []
+
+
+def query_budget(max_queries: int) -> Callable:
+    """
+    Decorator which declares the maximum number of SQL statements a view may
+    issue per request, including the statements of request hooks.
+
+    :param max_queries: The maximum number of statements.
+    :return: The decorator.
+    """
+
+    def decorator(view: Callable) -> Callable:
+        view.query_budget = max_queries  # type: ignore
+        return view
+
+    return decorator
+
+
+def init_app(app) -> None:
+    """
+    Count the SQL statements of every request and check them against the
+    budget of the view.
+
+    :param app: The Flask application object.
+    """
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _count_statement)
+
+    app.after_request(_check_budget)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+
+def _check_budget(response):
+    view = current_app.view_functions.get(request.endpoint)  # type: ignore
+    max_queries = getattr(view, "query_budget", None)
+    if max_queries is None:
+        return response
+
+    count = g.get("query_count", 0)
+    if count > max_queries:
+        message = (
+            f"{request.endpoint} issued {count} SQL statements, "
+            f"its budget is {max_queries}"
+        )
+        if current_app.config["QUERY_BUDGET_ENFORCE"]:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+    return response
+
+
+@contextlib.contextmanager
+def count_queries(app) -> Iterator[QueryCounter]:
+    """
+    Count the SQL statements issued inside the block, e.g. by test client
+    requests.
+
+    :param app: The Flask application object.
+    :return: A counter whose `count` is updated while the block runs.
+    """
+    counter = QueryCounter()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+        counter.statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+
+@contextlib.contextmanager
+def assert_max_queries(app, max_queries: int) -> Iterator[QueryCounter]:
+    """
+    Fail if the block issues more than `max_queries` SQL statements.
+
+    :param app: The Flask application object.
+    :param max_queries: The maximum number of statements.
+    :raises QueryBudgetExceeded: If the block issued more statements.
+    """
+    with count_queries(app) as counter:
+        yield counter
+
+    if counter.count > max_queries:
+        statements = "\n".join(counter.statements)
+        raise QueryBudgetExceeded(
+            f"{counter.count} SQL statements issued, expected at most "
+            f"{max_queries}:\n{statements}"
+        )
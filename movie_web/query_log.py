@@ -0,0 +1,140 @@
+"""
+Slow-query log and N+1 detector.
+
+When `QUERY_LOG_ENABLED` is set, every SQL statement of the app is timed via
+SQLAlchemy cursor events:
+
+- Statements slower than `SLOW_QUERY_THRESHOLD` seconds are logged with their
+  EXPLAIN QUERY PLAN output.
+- A statement which runs more than `N_PLUS_ONE_THRESHOLD` times with
+  different parameters in one request is logged as a likely N+1 query,
+  together with the view and the template which was rendering, e.g. a lazy
+  loaded `Movie.reviews` inside a loop.
+
+Enable it in development with `FLASK_QUERY_LOG_ENABLED=true`. In production
+the EXPLAIN only runs for slow statements, so it can stay enabled with a high
+threshold.
+"""
+
+import logging
+import time
+from collections import Counter
+
+from flask import (
+    before_render_template,
+    g,
+    has_request_context,
+    request,
+    template_rendered,
+)
+from sqlalchemy import event
+
+from movie_web.db_models import db
+
+logger = logging.getLogger(__name__)
+
+
+def init_app(app) -> None:
+    """
+    Time the SQL statements of the app and watch for N+1 queries, if
+    `QUERY_LOG_ENABLED` is set.
+
+    :param app: The Flask application object.
+    """
+    if not app.config["QUERY_LOG_ENABLED"]:
+        return
+
+    slow_threshold = app.config["SLOW_QUERY_THRESHOLD"]
+    repeat_threshold = app.config["N_PLUS_ONE_THRESHOLD"]
+
+    def start_statement(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        conn.info["query_log_started"] = time.perf_counter()
+
+    def end_statement(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        started = conn.info.pop("query_log_started", None)
+        if started is None:
+            return
+        duration = time.perf_counter() - started
+
+        if duration > slow_threshold:
+            log_slow_statement(cursor, statement, parameters, duration)
+        if repeat_threshold and has_request_context():
+            check_repeated_statement(statement, repeat_threshold)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", start_statement)
+    event.listen(engine, "after_cursor_execute", end_statement)
+
+    before_render_template.connect(_push_template, app)
+    template_rendered.connect(_pop_template, app)
+
+
+def log_slow_statement(cursor, statement, parameters, duration) -> None:
+    """
+    Log a slow statement with its query plan.
+
+    The plan is read through the raw DBAPI connection of the cursor, so it
+    runs in the same transaction and does not trigger engine events again.
+
+    :param cursor: The DBAPI cursor which executed the statement.
+    :param statement: The SQL statement.
+    :param parameters: The statement parameters.
+    :param duration: The execution time in seconds.
+    """
+    plan = ""
+    if statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        try:
+            rows = cursor.connection.execute(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).fetchall()
+            # rows are (id, parent, unused, detail)
+            plan = "\n".join(f"  {row[-1]}" for row in rows)
+        except Exception as e:
+            plan = f"  EXPLAIN failed: {e}"
+
+    logger.warning(
+        "Slow SQL statement (%.1f ms) in %s:\n%s\n%s",
+        duration * 1000,
+        request.endpoint if has_request_context() else "no request",
+        statement,
+        plan,
+    )
+
+
+def check_repeated_statement(statement: str, threshold: int) -> None:
+    """
+    Count a statement of the current request and log it once when it was
+    repeated more than `threshold` times.
+
+    :param statement: The SQL statement with parameter placeholders.
+    :param threshold: The allowed number of executions per request.
+    """
+    counts = g.setdefault("query_log_counts", Counter())
+    counts[statement] += 1
+    if counts[statement] != threshold + 1:
+        return
+
+    templates = g.get("query_log_templates", [])
+    logger.warning(
+        "Possible N+1 query in %s (template %s), statement repeated more "
+        "than %d times:\n%s",
+        request.endpoint,
+        templates[-1] if templates else "none",
+        threshold,
+        statement,
+    )
+
+
+def _push_template(sender, template, context, **extra) -> None:
+    if has_request_context():
+        g.setdefault("query_log_templates", []).append(template.name)
+
+
+def _pop_template(sender, template, context, **extra) -> None:
+    if has_request_context() and g.get("query_log_templates"):
+        g.query_log_templates.pop()
@@ -0,0 +1,136 @@
+"""
+Background refresh of stale movie data.
+
+Movies whose OMDB data is older than `MOVIE_REFRESH_MAX_AGE` seconds are
+fetched again in batches through the shared, rate-limited OMDB client. Only
+changed columns are written and every batch is committed once.
+
+The refresh runs on a background thread when `MOVIE_REFRESH_INTERVAL` is set,
+or once via `flask --app movie_web refresh-movies`, e.g. from cron.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple
+
+from requests import RequestException
+
+import movie_web.db_manager as db_manager
+import movie_web.omdb_api as omdb_api
+from movie_web.db_models import db
+
+logger = logging.getLogger(__name__)
+
+# the refresher waits for the shared rate limit instead of failing
+REFRESH_RATE_LIMIT_WAIT = 60
+
+
+class RefreshResult(NamedTuple):
+    checked: int
+    changed: int
+    failed: int
+
+
+def refresh_stale_movies(
+    max_age: float, batch_size: int, max_batches: int | None = None
+) -> RefreshResult:
+    """
+    Refresh movies which were fetched more than `max_age` seconds ago.
+
+    Needs an application context.
+
+    :param max_age: Age in seconds after which movie data is stale.
+    :param batch_size: Number of movies fetched and committed together.
+    :param max_batches: Stop after this many batches. Defaults to no limit.
+    :return: The number of checked, changed and failed movies.
+    """
+    client = omdb_api.get_client()
+    started = datetime.now(timezone.utc)
+    fetched_before = started - timedelta(seconds=max_age)
+    checked = changed = failed = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        movies = db_manager.get_stale_movies(fetched_before, batch_size)
+        if not movies:
+            break
+        batches += 1
+
+        fetched_ids = []
+        for movie in movies:
+            try:
+                omdb_response = client.get_movie(
+                    imdb_id=movie.imdb_id,
+                    rate_limit_wait=REFRESH_RATE_LIMIT_WAIT,
+                    bypass_cache=True,
+                )
+                refreshed_movie = db_manager.serialize_omdb_movie(omdb_response)
+            except omdb_api.OmdbUnavailableError as e:
+                # OMDB is failing, keep the rest for the next run
+                logger.warning("Stopping movie refresh: %s", e)
+                db_manager.mark_movies_fetched(fetched_ids, started)
+                db.session.commit()
+                return RefreshResult(checked, changed, failed)
+            except (ValueError, RequestException) as e:
+                # still mark the movie as fetched so it does not block the queue
+                logger.warning("Could not refresh %s: %s", movie.imdb_id, e)
+                failed += 1
+            else:
+                if db_manager.apply_movie_changes(movie, refreshed_movie):
+                    changed += 1
+            fetched_ids.append(movie.id)
+            checked += 1
+
+        db_manager.mark_movies_fetched(fetched_ids, started)
+        db.session.commit()
+
+    return RefreshResult(checked, changed, failed)
+
+
+class MovieRefresher:
+    """
+    Daemon thread which periodically refreshes stale movies of an app.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+        self.interval = app.config["MOVIE_REFRESH_INTERVAL"]
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="movie-refresher", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    result = refresh_stale_movies(
+                        max_age=self.app.config["MOVIE_REFRESH_MAX_AGE"],
+                        batch_size=self.app.config["MOVIE_REFRESH_BATCH_SIZE"],
+                    )
+                    logger.info(
+                        "Refreshed movies: %d checked, %d changed, %d failed",
+                        *result,
+                    )
+                except Exception:
+                    logger.exception("Movie refresh failed")
+                    db.session.rollback()
+
+
+def init_app(app) -> None:
+    """
+    Start the background refresher if `MOVIE_REFRESH_INTERVAL` is set.
+
+    :param app: The Flask application object.
+    """
+    if app.config["MOVIE_REFRESH_INTERVAL"]:
+        refresher = MovieRefresher(app)
+        app.extensions["movie_refresher"] = refresher
+        refresher.start()